@@ -98,7 +98,10 @@ for item in line_items:
 # This happens because t is an immutable object, that happens to have a mutable object
 # In the end, despite the error at the end, t will be modified
 t = (1, 2, [30, 40])
-t[2] += [50, 60]
+try:
+    t[2] += [50, 60]
+except TypeError as exc:
+    print(repr(exc), t)
 
 # Bisect does a binary search for needle in haystack—which must be a sorted sequence—to locate the position where needle can be inserted while maintaining 
 # haystack in ascending order
@@ -141,3 +144,289 @@ for i in range(SIZE):
 
 
 
+
+
+# Example 4: A sorted container for many insertions
+# insort is O(n) per insertion, because the list has to shift every item after the insertion point
+# Keeping the items in many small sorted lists (chunks) makes that shift cost at most the size of one chunk
+# The max of each chunk tells with a bisect in which chunk a value goes, and a positional index (the accumulated
+# length of the chunks) is rebuilt only when it is needed to translate a global position into (chunk, offset)
+import itertools
+import time
+
+class SortedList:
+    """A list that is always sorted, built as a list of sorted chunks of at most 2 * load items"""
+    def __init__(self, iterable=(), load=1000):
+        self._load = load
+        self._lists = []
+        self._maxes = []
+        self._offsets = None
+        for value in sorted(iterable):
+            if not self._lists or len(self._lists[-1]) >= load:
+                self._lists.append([])
+            self._lists[-1].append(value)
+        self._maxes = [chunk[-1] for chunk in self._lists]
+
+    def add(self, value):
+        if not self._lists:
+            self._lists.append([value])
+            self._maxes.append(value)
+        else:
+            pos = bisect.bisect_right(self._maxes, value)
+            if pos == len(self._maxes):
+                pos -= 1
+                self._lists[pos].append(value)
+                self._maxes[pos] = value
+            else:
+                bisect.insort(self._lists[pos], value)
+            chunk = self._lists[pos]
+            if len(chunk) > 2 * self._load:
+                # The chunk grew too much, so it is split in two halves
+                self._lists[pos:pos+1] = [chunk[:self._load], chunk[self._load:]]
+                self._maxes.insert(pos, chunk[self._load - 1])
+        self._offsets = None
+
+    def remove(self, value):
+        pos = bisect.bisect_left(self._maxes, value)
+        if pos < len(self._maxes):
+            chunk = self._lists[pos]
+            i = bisect.bisect_left(chunk, value)
+            if chunk[i] == value:
+                del chunk[i]
+                if chunk:
+                    self._maxes[pos] = chunk[-1]
+                else:
+                    del self._lists[pos]
+                    del self._maxes[pos]
+                self._offsets = None
+                return
+        raise ValueError('%r not in SortedList' % (value,))
+
+    def _index(self):
+        if self._offsets is None:
+            self._offsets = list(itertools.accumulate(map(len, self._lists), initial=0))
+        return self._offsets
+
+    def bisect_left(self, value):
+        pos = bisect.bisect_left(self._maxes, value)
+        if pos == len(self._maxes):
+            return len(self)
+        return self._index()[pos] + bisect.bisect_left(self._lists[pos], value)
+
+    def bisect_right(self, value):
+        pos = bisect.bisect_right(self._maxes, value)
+        if pos == len(self._maxes):
+            return len(self)
+        return self._index()[pos] + bisect.bisect_right(self._lists[pos], value)
+
+    bisect = bisect_right
+
+    def __len__(self):
+        return self._index()[-1]
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('SortedList index out of range')
+        offsets = self._index()
+        pos = bisect.bisect_right(offsets, position) - 1
+        return self._lists[pos][position - offsets[pos]]
+
+    def __contains__(self, value):
+        pos = bisect.bisect_left(self._maxes, value)
+        if pos == len(self._maxes):
+            return False
+        chunk = self._lists[pos]
+        return chunk[bisect.bisect_left(chunk, value)] == value
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._lists)
+
+    def irange(self, minimum=None, maximum=None):
+        """Iterate over the values with minimum <= value <= maximum (None means no limit)"""
+        start = 0 if minimum is None else self.bisect_left(minimum)
+        stop = len(self) if maximum is None else self.bisect_right(maximum)
+        if start >= stop:
+            return
+        offsets = self._index()
+        pos = bisect.bisect_right(offsets, start) - 1
+        start -= offsets[pos]
+        stop -= offsets[pos]
+        for chunk in self._lists[pos:]:
+            yield from chunk[start:stop]
+            stop -= len(chunk)
+            if stop <= 0:
+                break
+            start = 0
+
+    def __repr__(self):
+        return 'SortedList(%r)' % list(self)
+
+def bench_sorted(sizes=(10**4, 10**5, 10**6)):
+    """Compare bisect.insort on a plain list with SortedList.add for random values"""
+    for size in sizes:
+        random.seed(1729)
+        values = [random.random() for _ in range(size)]
+        t0 = time.perf_counter()
+        plain = []
+        for value in values:
+            bisect.insort(plain, value)
+        insort_time = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        sorted_list = SortedList()
+        for value in values:
+            sorted_list.add(value)
+        add_time = time.perf_counter() - t0
+        print('%8d items: insort %8.3fs  SortedList.add %8.3fs' % (size, insort_time, add_time))
+
+if __name__ == '__main__':
+    sorted_list = SortedList(random.randrange(SIZE*2) for _ in range(SIZE))
+    sorted_list.add(5)
+    print(sorted_list, sorted_list.bisect_left(5), list(sorted_list.irange(3, 9)))
+    bench_sorted()
+
+# Example 5: Parsing huge fixed-width files with the same named slices
+# Slicing each line of invoice.split('\n') creates a new string for every line and for every field
+# For files with millions of lines we can memory-map the file and walk it with a memoryview: slicing a memoryview
+# shares the bytes of the file instead of copying them, so only the fields we ask for are decoded
+# Note: the slices count bytes here, which is the same as counting characters for ASCII feeds
+# A field that fails to decode raises ValueError with the line number. The views of the fields are released before
+# that, otherwise the traceback would keep them alive and the memory map could not be closed
+import mmap
+import os
+from array import array
+import tempfile
+from collections import namedtuple
+from decimal import Decimal
+
+def text_field(field):
+    return str(field, 'utf-8').strip()
+
+def money_field(field):
+    return Decimal(str(field, 'ascii').strip().lstrip('$').replace(',', ''))
+
+# field name -> (named slice, function that converts the bytes of the field)
+INVOICE_LAYOUT = {
+    'sku': (SKU, text_field),
+    'description': (DESCRIPTION, text_field),
+    'unit_price': (UNIT_PRICE, money_field),
+    'quantity': (QUANTITY, int),  # int() accepts bytes-like objects directly
+    'item_total': (ITEM_TOTAL, money_field),
+}
+
+def iter_lines(path, skip=0):
+    """Yield (line number, memoryview) for each non-blank line of the file, without the line break.
+    The views point to the memory map, so they are only valid until the next line is read"""
+    with open(path, 'rb') as fp:
+        if not os.fstat(fp.fileno()).st_size:
+            return
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            start = line_no = 0
+            while start < size:
+                end = mm.find(b'\n', start)
+                if end == -1:
+                    end = size
+                stop = end - 1 if end > start and mm[end-1] == ord('\r') else end
+                if line_no >= skip and stop > start:
+                    with memoryview(mm)[start:stop] as line:
+                        yield line_no + 1, line
+                start = end + 1
+                line_no += 1
+
+def decode_fields(line, line_no, decoders):
+    """Return the list of fields of the line, decoders is a list of (slice, decode)"""
+    try:
+        return [decode(line[field_slice]) for field_slice, decode in decoders]
+    except (ValueError, ArithmeticError):
+        pass
+    # Out of the except block the exception and the field views kept by its traceback are gone. The fields are
+    # decoded again one by one, releasing each view, to tell which one failed
+    for field_slice, decode in decoders:
+        with line[field_slice] as field:
+            try:
+                decode(field)
+                continue
+            except (ValueError, ArithmeticError) as exc:
+                error, raw = exc, bytes(field)
+        start, stop, _ = field_slice.indices(len(line))
+        hint = '' if bytes(line).isascii() else ' (the line has non-ASCII bytes, which shift the byte offsets)'
+        raise ValueError('line %d, bytes %d:%d: cannot decode %r%s' % (line_no, start, stop, raw, hint)) from error
+
+def parse_records(path, fields=tuple(INVOICE_LAYOUT), skip=0, layout=INVOICE_LAYOUT):
+    """Yield a namedtuple per line with only the requested fields, already converted (Decimal prices, int quantity)"""
+    Record = namedtuple('Record', fields)
+    decoders = [layout[name] for name in fields]
+    for line_no, line in iter_lines(path, skip):
+        yield Record._make(decode_fields(line, line_no, decoders))
+
+def parse_columns(path, fields=tuple(INVOICE_LAYOUT), skip=0, layout=INVOICE_LAYOUT):
+    """Same as parse_records, but returns a dict of columns: int fields go to an array('q'), the others to lists"""
+    decoders = [layout[name] for name in fields]
+    columns = {name: array('q') if decode is int else [] for name, (_, decode) in zip(fields, decoders)}
+    appends = [columns[name].append for name in fields]
+    for line_no, line in iter_lines(path, skip):
+        for append, value in zip(appends, decode_fields(line, line_no, decoders)):
+            append(value)
+    return columns
+
+# Example 6: Columnar batches and aggregations during the scan
+# When a report only needs totals, building one object per line item is wasted work
+# parse_batch returns whole columns: prices become floats in an array('d'), quantities go to an array('i') and
+# strings are interned, so a SKU that repeats a million times is stored only once
+# sum_by goes one step further and adds the values while scanning the file, so no column is ever built
+def float_field(field):
+    return float(str(field, 'ascii').strip().lstrip('$').replace(',', ''))
+
+def interned_text_field(field):
+    return sys.intern(text_field(field))
+
+# decoder of the layout -> (typecode of the column or None for a list, decoder used in batch mode)
+BATCH_DECODERS = {
+    money_field: ('d', float_field),
+    int: ('i', int),
+    text_field: (None, interned_text_field),
+}
+
+def parse_batch(path, fields=tuple(INVOICE_LAYOUT), skip=0, layout=INVOICE_LAYOUT):
+    """Return a dict of columns: numbers in typed arrays and interned strings in lists"""
+    columns = {}
+    appends, decoders = [], []
+    for name in fields:
+        field_slice, decode = layout[name]
+        typecode, batch_decode = BATCH_DECODERS[decode]
+        columns[name] = [] if typecode is None else array(typecode)
+        appends.append(columns[name].append)
+        decoders.append((field_slice, batch_decode))
+    for line_no, line in iter_lines(path, skip):
+        for append, value in zip(appends, decode_fields(line, line_no, decoders)):
+            append(value)
+    return columns
+
+def sum_by(path, value='item_total', key='sku', skip=0, layout=INVOICE_LAYOUT):
+    """Return {key: sum of value} computed during the scan, like SUM(value) GROUP BY key.
+    With key=None it returns the grand total. Values use the decoder of the layout, so money stays exact (Decimal)"""
+    if key is None:
+        decoders = [layout[value]]
+        return sum(decode_fields(line, line_no, decoders)[0] for line_no, line in iter_lines(path, skip))
+    decoders = [layout[key], layout[value]]
+    totals = {}
+    for line_no, line in iter_lines(path, skip):
+        group, amount = decode_fields(line, line_no, decoders)
+        totals[group] = totals.get(group, 0) + amount
+    return totals
+
+if __name__ == '__main__':
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as fp:
+        for sku, description, price, quantity in [('1909', 'Pimoroni PiBrella', '17.50', 3),
+                                                  ('1489', '6mm Tactile Switch x20', '4.95', 2),
+                                                  ('1510', 'Panavise Jr. - PV-201', '28.00', 1)]:
+            item_total = Decimal(price) * quantity
+            fp.write('%-6s%-34s%12s%3d $%s\n' % (sku, description, '$' + price, quantity, item_total))
+    for record in parse_records(fp.name, ('sku', 'unit_price', 'quantity')):
+        print(record)
+    print(parse_columns(fp.name, ('quantity', 'item_total')))
+    print(parse_batch(fp.name, ('sku', 'unit_price', 'quantity')))
+    print(sum_by(fp.name), sum_by(fp.name, key=None))
+    os.remove(fp.name)
@@ -91,10 +91,643 @@ for n in NEEDLES:
     if n in HAYSTACK:
         found += 1
 
-# If they are both sets, the counting can be done on this way
-found = len(NEEDLES & HAYSTACK)
+# If they are both sets, the counting can be done on this way: len(NEEDLES & HAYSTACK)
+# As they are lists here, they are converted to sets first (& between two lists raises TypeError)
 found = len(set(NEEDLES) & set(HAYSTACK))
 
 # Example 4: Building setcomps
 from unicodedata import name 
-{chr(i) for i in range(32, 256) if 'SIGN' in name(chr(i),'')} 
\ No newline at end of file
+{chr(i) for i in range(32, 256) if 'SIGN' in name(chr(i),'')}
+
+# Example 5: A persistent on-disk index
+# Examples 1 and 2 rebuild the whole index in memory every time the script runs, which is too slow for big corpora
+# Here each text file gets its own postings file, where each occurrence is stored as (line delta, column) in varints:
+# 7 bits per byte, with the high bit set on every byte but the last one. Storing the difference from the previous
+# line keeps the numbers small, so most of them take a single byte instead of 4
+# The lexicon is a binary file: the word count, then (word offset, postings offset) for each word plus one closing
+# entry, then the words in UTF-8 sorted by their bytes. A lookup memory-maps it and does a binary search reading only
+# a few entries, then decodes just the postings of the word, so neither file is ever loaded whole
+# A manifest keeps the mtime and the sha1 of every indexed file, so only the files that changed are reindexed
+import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+MANIFEST = 'manifest.json'
+INDEX_FORMAT = 2  # files indexed with another format are indexed again
+POSTING_SIZE = array.array('I').itemsize
+LEX_COUNT = struct.Struct('<I')
+LEX_ENTRY = struct.Struct('<II')  # (offset of the word in the words blob, offset of its postings)
+
+def encode_varint(number, out):
+    """Append number to the bytearray out as a varint"""
+    while number >= 0x80:
+        out.append(number & 0x7f | 0x80)
+        number >>= 7
+    out.append(number)
+
+def decode_varints(data):
+    """Yield the numbers of the varints in data (bytes or a slice of a memory map)"""
+    number = shift = 0
+    for byte in data:
+        number |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield number
+            number = shift = 0
+
+def file_digest(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def index_file(path):
+    """Build the in-memory index of a single file, the same way as Example 2"""
+    index = collections.defaultdict(list)
+    with open(path, encoding='utf-8') as fp:
+        for line_no, line in enumerate(fp, 1):
+            for match in WORD_RE.finditer(line):
+                index[match.group()].append((line_no, match.start()+1))
+    return index
+
+def write_postings(index, base):
+    """Save the index as base.post (varint delta encoded postings) and base.lex (the binary lexicon)"""
+    postings = bytearray()
+    words = bytearray()
+    entries = []
+    for word in sorted(index, key=lambda word: word.encode('utf-8')):
+        entries.append(LEX_ENTRY.pack(len(words), len(postings)))
+        words += word.encode('utf-8')
+        last_line = 0
+        for line_no, column_no in index[word]:
+            encode_varint(line_no - last_line, postings)
+            encode_varint(column_no, postings)
+            last_line = line_no
+    entries.append(LEX_ENTRY.pack(len(words), len(postings)))
+    write_atomic(base + '.post', [postings])
+    write_atomic(base + '.lex', [LEX_COUNT.pack(len(index))] + entries + [words])
+
+def write_atomic(path, chunks):
+    """Write the file under a temporary name and rename it, so a reader (or a crash) never sees it half written"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fp:
+        fp.writelines(chunks)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+def remove_index_files(base):
+    for ext in ('.post', '.lex'):
+        try:
+            os.remove(base + ext)
+        except FileNotFoundError:
+            pass
+
+def update_index(paths, index_dir):
+    """Reindex only the files whose mtime and content changed since the last run; returns the reindexed paths"""
+    os.makedirs(index_dir, exist_ok=True)
+    manifest_path = os.path.join(index_dir, MANIFEST)
+    try:
+        with open(manifest_path, encoding='utf-8') as fp:
+            manifest = json.load(fp)
+    except FileNotFoundError:
+        manifest = {}
+    # The files of an index are never rewritten: a new version gets new names (the sha1 of the content is part of
+    # them), the manifest is replaced in one rename, and only then the old files are removed. A DiskIndex that has
+    # the old files mapped keeps reading them, and a crash leaves the last manifest with its files intact
+    obsolete = []
+    # Forget the files that were deleted since the last run
+    for path in [path for path in manifest if not os.path.exists(path)]:
+        obsolete.append(manifest.pop(path)['base'])
+    reindexed = []
+    for path in map(os.path.abspath, paths):
+        mtime = os.stat(path).st_mtime_ns
+        entry = manifest.get(path)
+        if entry is not None and entry.get('format') != INDEX_FORMAT:
+            entry = None
+        if entry is not None and entry['mtime'] == mtime:
+            continue
+        # The mtime may change without the content changing (a touch, a copy), so the hash has the final word
+        digest = file_digest(path)
+        if entry is None or entry['sha1'] != digest:
+            base = os.path.join(index_dir, '%s-%s' % (hashlib.sha1(path.encode('utf-8')).hexdigest(), digest[:16]))
+            write_postings(index_file(path), base)
+            if entry is not None and entry['base'] != base:
+                obsolete.append(entry['base'])
+            reindexed.append(path)
+        else:
+            base = entry['base']
+        manifest[path] = {'mtime': mtime, 'sha1': digest, 'base': base, 'format': INDEX_FORMAT}
+    write_atomic(manifest_path, [json.dumps(manifest).encode('utf-8')])
+    for base in obsolete:
+        remove_index_files(base)
+    return reindexed
+
+def map_file(path):
+    """Memory-map a file for reading, or return b'' for an empty file (mmap can't map those)"""
+    with open(path, 'rb') as fp:
+        if not os.fstat(fp.fileno()).st_size:
+            return b''
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+def lex_search(lexicon, key):
+    """Binary search of the UTF-8 bytes key in a mapped lexicon, returns the (start, end) of its postings or None"""
+    count, = LEX_COUNT.unpack_from(lexicon)
+    words_start = LEX_COUNT.size + (count + 1) * LEX_ENTRY.size
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        position = LEX_COUNT.size + middle * LEX_ENTRY.size
+        word_start, postings_start = LEX_ENTRY.unpack_from(lexicon, position)
+        word_end, postings_end = LEX_ENTRY.unpack_from(lexicon, position + LEX_ENTRY.size)
+        word = lexicon[words_start + word_start:words_start + word_end]
+        if word == key:
+            return postings_start, postings_end
+        if word < key:
+            low = middle + 1
+        else:
+            high = middle
+    return None
+
+class DiskIndex:
+    """Read-only access to the index written by update_index"""
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self._load_manifest()
+        self._maps = {}
+
+    def _load_manifest(self):
+        with open(os.path.join(self.index_dir, MANIFEST), encoding='utf-8') as fp:
+            self._manifest = json.load(fp)
+
+    def _map(self, path):
+        base = self._manifest[path]['base']
+        lexicon = map_file(base + '.lex')
+        try:
+            return lexicon, map_file(base + '.post')
+        except FileNotFoundError:
+            if isinstance(lexicon, mmap.mmap):
+                lexicon.close()
+            raise
+
+    def _open(self, path):
+        """The mapped (lexicon, postings) of an indexed file, or None if it is no longer indexed"""
+        # The files of each indexed file are only mapped the first time they are needed. Files that are already
+        # mapped stay readable after update_index replaces them; if they were removed before that, the new manifest
+        # is read
+        if path not in self._maps:
+            try:
+                self._maps[path] = self._map(path)
+            except FileNotFoundError:
+                self._load_manifest()
+                if path not in self._manifest:
+                    return None
+                self._maps[path] = self._map(path)
+        return self._maps[path]
+
+    def lookup(self, word):
+        """Yield (path, line_no, column_no) for every occurrence of word"""
+        key = word.encode('utf-8')
+        for path in sorted(self._manifest):
+            maps = self._open(path)
+            if maps is None:
+                continue
+            lexicon, postings = maps
+            found = lex_search(lexicon, key)
+            if found is None:
+                continue
+            start, end = found
+            values = decode_varints(postings[start:end])
+            line_no = 0
+            for delta, column_no in zip(values, values):
+                line_no += delta
+                yield path, line_no, column_no
+
+    def close(self):
+        for maps in self._maps.values():
+            for mapped in maps:
+                if isinstance(mapped, mmap.mmap):
+                    mapped.close()
+        self._maps.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+if __name__ == '__main__':
+    print('reindexed ->', update_index(sys.argv[1:], 'word_index'))
+    with DiskIndex('word_index') as disk_index:
+        print(list(disk_index.lookup('the')))
+
+# Example 6: Sharding the index across processes
+# The loop of Example 2 runs on a single core. To use all of them we cut the input in shards (every file of a directory,
+# and big files are cut in chunks at line boundaries), index each shard in a ProcessPoolExecutor and then merge the partial
+# indexes. Every worker returns its words already sorted by str.upper, so the merge is a k-way merge with heapq.merge
+# split_file counts the lines before each shard, so the workers return final line numbers and the merge only
+# concatenates the lists of locations of each word
+# Words that only differ in case ('the', 'The') keep the order of their first occurrence, like sorted(index, key=str.upper) does
+import functools
+import heapq
+import io
+import itertools
+import time
+from concurrent import futures
+
+CHUNK_SIZE = 64 * 1024 * 1024
+
+def split_file(path, chunk_size=CHUNK_SIZE):
+    """Cut a file in (path, start, end, first_line) byte ranges that always end at a line boundary.
+    first_line is the number of lines before start, counted here with bytes.count so workers return final line numbers"""
+    shards = []
+    start = line_offset = 0
+    with open(path, 'rb') as fp:
+        while True:
+            block = fp.read(chunk_size)
+            if not block:
+                break
+            block += fp.readline()  # go on to the end of the line
+            shards.append((path, start, start + len(block), line_offset))
+            start += len(block)
+            line_offset += block.count(b'\n')
+    return shards
+
+def index_shard(shard, with_path=False):
+    """Worker: index one shard, returns its words sorted by str.upper with their final locations"""
+    path, start, end, line_offset = shard
+    index = collections.defaultdict(list)
+    with open(path, 'rb') as fp:
+        fp.seek(start)
+        chunk = io.TextIOWrapper(io.BytesIO(fp.read(end - start)), encoding='utf-8')
+    for line_no, line in enumerate(chunk, line_offset + 1):
+        for match in WORD_RE.finditer(line):
+            location = (path, line_no, match.start()+1) if with_path else (line_no, match.start()+1)
+            index[match.group()].append(location)
+    return [(word, index[word]) for word in sorted(index, key=str.upper)]
+
+def merge_shards(results):
+    """k-way merge of the partial indexes, yielding (word, locations) in the same order as Example 2.
+    The locations are final, so the merge only concatenates the lists of the shards"""
+    # The shard number and the position in the shard go in the sort key, so the first occurrence of each word
+    # decides the order of the words that only differ in case
+    streams = [[(word.upper(), shard_no, position, word, locations)
+                for position, (word, locations) in enumerate(words)]
+               for shard_no, words in enumerate(results)]
+    merged = heapq.merge(*streams, key=lambda entry: entry[:3])
+    for _, group in itertools.groupby(merged, key=lambda entry: entry[0]):
+        words = {}
+        for _, _, _, word, locations in group:
+            if word in words:
+                words[word].extend(locations)
+            else:
+                words[word] = locations
+        yield from words.items()
+
+def sharded_index(target, workers=None, chunk_size=CHUNK_SIZE):
+    """Index a file or every file of a directory using a pool of processes.
+    Locations are (line_no, column_no) for a single file and (path, line_no, column_no) for a directory"""
+    if os.path.isdir(target):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(target) for name in names)
+    else:
+        paths = [target]
+    shards = [shard for path in paths for shard in split_file(path, chunk_size)]
+    worker = functools.partial(index_shard, with_path=os.path.isdir(target))
+    if workers == 1:
+        results = list(map(worker, shards))
+    else:
+        with futures.ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(worker, shards))
+    return merge_shards(results)
+
+def bench_sharded(target, chunk_size=CHUNK_SIZE):
+    """Time sharded_index with 1, 2, 4... workers up to the number of cores and show the speedup"""
+    workers, timings = 1, {}
+    while True:
+        t0 = time.perf_counter()
+        for _ in sharded_index(target, workers, chunk_size):
+            pass
+        timings[workers] = time.perf_counter() - t0
+        print('%3d workers: %8.3fs  speedup %5.2fx' % (workers, timings[workers], timings[1] / timings[workers]))
+        if workers >= os.cpu_count():
+            break
+        workers = min(workers * 2, os.cpu_count())
+
+if __name__ == '__main__':
+    for word, locations in sharded_index(sys.argv[1]):
+        print(word, locations)
+    bench_sharded(sys.argv[1], chunk_size=1024 * 1024)
+
+# Example 7: Printing the index with bounded memory (external sort)
+# The final loop of Examples 1 and 2 needs the whole index in memory before printing the first word
+# Instead, we can keep a buffer of (word.upper(), word, line_no, column_no) entries, and every time the buffer
+# goes over the memory budget we sort it and spill it to a temporary file (a "sorted run")
+# In the end heapq.merge streams the runs, so only one entry per run is kept in memory. A run is a file that is only
+# open while it is merged, and at most MERGE_FAN_IN runs are merged at the same time: when a level gets that many
+# runs they are merged into one run of the next level, and the runs left at the end are merged in passes, so big
+# inputs don't run out of file descriptors or buffer memory
+# The locations of each word are streamed too: a word that appears millions of times is never held in a list
+# Note: words that only differ in case are ordered by the word itself, and not by the first occurrence like in Example 2
+import tempfile
+
+MEMORY_BUDGET = 64 * 1024 * 1024
+MERGE_FAN_IN = 64  # most runs open (and merged) at the same time
+ENTRY_OVERHEAD = sys.getsizeof((None, None, 0, 0)) + 2 * sys.getsizeof(0)
+
+class RunFiles:
+    """Sorted runs saved in a temporary directory. A run is only open while it is being read"""
+    def __init__(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._count = 0
+
+    def write(self, entries):
+        """Write sorted entries to a new run, returns its path"""
+        self._count += 1
+        path = os.path.join(self._directory.name, 'run%d' % self._count)
+        with open(path, 'w', encoding='utf-8') as fp:
+            fp.writelines('%s\t%s\t%d\t%d\n' % entry for entry in entries)
+        return path
+
+    def spill(self, buffer):
+        """Sort the buffer and write it to a run"""
+        buffer.sort()
+        path = self.write(buffer)
+        buffer.clear()
+        return path
+
+    @staticmethod
+    def read(path):
+        with open(path, encoding='utf-8') as fp:
+            for line in fp:
+                upper, word, line_no, column_no = line.rstrip('\n').split('\t')
+                yield upper, word, int(line_no), int(column_no)
+
+    def merge(self, paths):
+        """Merge at most MERGE_FAN_IN runs into a new one, deleting them"""
+        merged = self.write(heapq.merge(*map(self.read, paths)))
+        for path in paths:
+            os.remove(path)
+        return merged
+
+    def close(self):
+        self._directory.cleanup()
+
+def external_index(path, memory_budget=MEMORY_BUDGET):
+    """Yield (word, locations) sorted by word.upper(), never keeping more than memory_budget bytes of entries.
+    locations is an iterator of (line_no, column_no), like groupby it is only valid until the next word is read"""
+    run_files = RunFiles()
+    levels = [[]]  # levels[k] has the runs that went through k merges
+    buffer = []
+    used = 0
+
+    def add_run(run):
+        # A level that gets MERGE_FAN_IN runs is merged into one run of the next level
+        level = 0
+        levels[level].append(run)
+        while len(levels[level]) == MERGE_FAN_IN:
+            merged = run_files.merge(levels[level])
+            levels[level] = []
+            level += 1
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(merged)
+
+    try:
+        with open(path, encoding='utf-8') as fp:
+            for line_no, line in enumerate(fp, 1):
+                for match in WORD_RE.finditer(line):
+                    word = match.group()
+                    upper = word.upper()
+                    buffer.append((upper, word, line_no, match.start()+1))
+                    used += ENTRY_OVERHEAD + sys.getsizeof(word) + sys.getsizeof(upper)
+                    if used >= memory_budget:
+                        add_run(run_files.spill(buffer))
+                        used = 0
+        if buffer:
+            add_run(run_files.spill(buffer))
+        # The levels may still have up to MERGE_FAN_IN - 1 runs each: merge them in passes until one merge is enough
+        runs = [run for level in levels for run in level]
+        while len(runs) > MERGE_FAN_IN:
+            runs[:MERGE_FAN_IN] = [run_files.merge(runs[:MERGE_FAN_IN])]
+        merged = heapq.merge(*map(run_files.read, runs))
+        for (_, word), entries in itertools.groupby(merged, key=lambda entry: entry[:2]):
+            yield word, ((line_no, column_no) for _, _, line_no, column_no in entries)
+    finally:
+        run_files.close()
+
+if __name__ == '__main__':
+    for word, locations in external_index(sys.argv[1], memory_budget=1024 * 1024):
+        print(word, end='')
+        for location in locations:
+            print('', location, end='')
+        print()
+
+# Example 8: Compact postings with array.array
+# Each location of Examples 1 and 2 is a (line_no, column_no) tuple inside a list: a pointer in the list,
+# plus the tuple object, plus two int objects. An array keeps the raw numbers inside its own memory space,
+# so here both numbers of each location go into a single array of unsigned ints: [line, col, line, col, ...]
+# The class behaves like the list of tuples for append, iteration and repr, so the printing loop doesn't change
+class Postings:
+    __slots__ = ('_data',)
+
+    def __init__(self, locations=()):
+        self._data = array.array('I')
+        for location in locations:
+            self.append(location)
+
+    def append(self, location):
+        line_no, column_no = location
+        self._data.append(line_no)
+        self._data.append(column_no)
+
+    def __len__(self):
+        return len(self._data) // 2
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('Postings index out of range')
+        return self._data[2*position], self._data[2*position+1]
+
+    def __iter__(self):
+        data = self._data
+        return zip(data[::2], data[1::2])
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def nbytes(self):
+        return sys.getsizeof(self) + sys.getsizeof(self._data)
+
+def index_nbytes(index):
+    """Approximate memory used by an index: the dict, the keys and the postings (list of tuples or Postings)"""
+    total = sys.getsizeof(index)
+    for word, postings in index.items():
+        total += sys.getsizeof(word)
+        if isinstance(postings, Postings):
+            total += postings.nbytes()
+        else:
+            # small ints are shared by the interpreter, so this overestimates the list layout a little
+            total += sys.getsizeof(postings)
+            total += sum(sys.getsizeof(location) + sum(map(sys.getsizeof, location)) for location in postings)
+    return total
+
+def compare_postings(path):
+    """Build the index of Example 2 with both layouts and print the memory used by each one"""
+    lists = collections.defaultdict(list)
+    arrays = collections.defaultdict(Postings)
+    with open(path, encoding='utf-8') as fp:
+        for line_no, line in enumerate(fp, 1):
+            for match in WORD_RE.finditer(line):
+                location = (line_no, match.start()+1)
+                lists[match.group()].append(location)
+                arrays[match.group()].append(location)
+    occurrences = sum(map(len, lists.values()))
+    for label, index in (('list of tuples', lists), ('Postings', arrays)):
+        nbytes = index_nbytes(index)
+        print('%-15s %12d bytes  %6.1f bytes/occurrence' % (label, nbytes, nbytes / max(occurrences, 1)))
+
+if __name__ == '__main__':
+    compare_postings(sys.argv[1])
+
+# Example 9: Searching millions of needles at once
+# Example 3 tests one needle at a time, and the bisect demo of chapter 2 finds one insertion point at a time
+# When both lists are big it is faster to answer every needle in one call: with NumPy, searchsorted does the
+# binary searches in C; without it, we sort the needles and walk both sorted sequences together (like a merge),
+# so the haystack is read only once. left/right follow the semantics of bisect_left and bisect (bisect_right)
+from collections import namedtuple
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+Membership = namedtuple('Membership', 'found counts left right mask')
+
+def batch_search(haystack, needles, typecode='q'):
+    """Search every needle in the sorted haystack, returning a Membership with:
+    found (how many needles are in the haystack), counts (occurrences of each needle),
+    left/right (bisect_left/bisect_right positions) and mask (1 if the needle is in the haystack)"""
+    if numpy is not None:
+        hay = numpy.asarray(haystack)
+        left = hay.searchsorted(needles, 'left')
+        right = hay.searchsorted(needles, 'right')
+        counts = right - left
+        mask = counts > 0
+        return Membership(int(mask.sum()), counts, left, right, mask)
+    size = len(needles)
+    left = array.array(typecode, bytes(size * array.array(typecode).itemsize))
+    right = array.array(typecode, left)
+    position_left = position_right = 0
+    for i in sorted(range(size), key=needles.__getitem__):
+        needle = needles[i]
+        while position_left < len(haystack) and haystack[position_left] < needle:
+            position_left += 1
+        position_right = max(position_right, position_left)
+        while position_right < len(haystack) and haystack[position_right] <= needle:
+            position_right += 1
+        left[i] = position_left
+        right[i] = position_right
+    counts = array.array(typecode, (r - l for l, r in zip(left, right)))
+    mask = array.array('b', (count > 0 for count in counts))
+    return Membership(sum(mask), counts, left, right, mask)
+
+if __name__ == '__main__':
+    result = batch_search(HAYSTACK, NEEDLES)
+    print('found:', result.found)
+    for needle, position in zip(NEEDLES, result.left):
+        print('%2d @ %2d' % (needle, position))
+
+# Example 10: A character finder with a precomputed index of Unicode names
+# Example 4 calls unicodedata.name for every code point each time we search for something
+# Instead, we can build once an inverted index from each word of the names to the code points that have it,
+# and save it in a compact binary file: a header, the offsets of the postings of each word (array of unsigned ints),
+# the words separated by newlines and the postings (the code points, also unsigned ints)
+# At startup only the word list is decoded, the postings are read from a memory map when they are needed,
+# and a query like 'CURRENCY SIGN' is the intersection of the code points of each word
+# Note: the index matches whole words ('SIGN'), while Example 4 also matches parts of words ('SIGNAL')
+import struct
+import unicodedata
+
+NAMES_INDEX = 'unicode_names.idx'
+NAMES_MAGIC = b'UNAM'
+NAMES_HEADER = struct.Struct('<4s16sIII')  # magic, unicodedata version, words, words bytes, postings
+
+def name_words(name):
+    words = name.split()
+    # hyphenated words are indexed whole and by part: 'HYPHEN-MINUS', 'HYPHEN' and 'MINUS'
+    return set(words + [part for word in words if '-' in word for part in word.split('-')])
+
+def build_names_index(path=NAMES_INDEX):
+    index = collections.defaultdict(lambda: array.array('I'))
+    for code in range(sys.maxunicode + 1):
+        for word in name_words(unicodedata.name(chr(code), '')):
+            index[word].append(code)
+    words = sorted(index)
+    offsets = array.array('I', [0])
+    for word in words:
+        offsets.append(offsets[-1] + len(index[word]))
+    blob = '\n'.join(words).encode('ascii')
+    with open(path, 'wb') as fp:
+        fp.write(NAMES_HEADER.pack(NAMES_MAGIC, unicodedata.unidata_version.encode('ascii'),
+                                   len(words), len(blob), offsets[-1]))
+        offsets.tofile(fp)
+        fp.write(blob)
+        for word in words:
+            index[word].tofile(fp)
+
+class CharFinder:
+    """Find characters by the words of their names, using the index file (built if missing or outdated)"""
+    def __init__(self, path=NAMES_INDEX):
+        if not self._is_current(path):
+            build_names_index(path)
+        with open(path, 'rb') as fp:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        _, _, word_count, blob_size, _ = NAMES_HEADER.unpack_from(self._mmap)
+        start = NAMES_HEADER.size
+        self._offsets = array.array('I', self._mmap[start:start + (word_count + 1) * POSTING_SIZE])
+        start += len(self._offsets) * POSTING_SIZE
+        words = self._mmap[start:start + blob_size].decode('ascii').split('\n')
+        self._words = {word: i for i, word in enumerate(words)}
+        self._postings_start = start + blob_size
+
+    @staticmethod
+    def _is_current(path):
+        try:
+            with open(path, 'rb') as fp:
+                magic, version, *_ = NAMES_HEADER.unpack(fp.read(NAMES_HEADER.size))
+        except (FileNotFoundError, struct.error):
+            return False
+        return magic == NAMES_MAGIC and version.rstrip(b'\0').decode('ascii') == unicodedata.unidata_version
+
+    def _postings(self, word):
+        i = self._words.get(word)
+        if i is None:
+            return array.array('I')
+        start = self._postings_start + self._offsets[i] * POSTING_SIZE
+        return array.array('I', self._mmap[start:start + (self._offsets[i+1] - self._offsets[i]) * POSTING_SIZE])
+
+    def find(self, query):
+        """Return the characters whose names have all the words of the query, e.g. 'CURRENCY SIGN'"""
+        postings = sorted(map(self._postings, query.upper().split()), key=len)
+        if not postings:
+            return []
+        # Start from the smallest postings, so the intersections only get smaller
+        codes = set(postings[0])
+        for other in postings[1:]:
+            codes.intersection_update(other)
+        return [chr(code) for code in sorted(codes)]
+
+    def close(self):
+        self._mmap.close()
+
+if __name__ == '__main__':
+    finder = CharFinder()
+    print(finder.find('currency sign'))
+    print(set(finder.find('sign')) >= {chr(i) for i in range(32, 256) if 'SIGN' in name(chr(i), '').split()})
+    finder.close()
@@ -77,6 +77,90 @@ print(len(normalize('NFC', s1)), len(normalize('NFC', s2)))
 print(len(normalize('NFD', s1)), len(normalize('NFD', s2)))
 print(normalize('NFC', s1) == normalize('NFC', s2))
 
+# Normalizing big files
+# normalize() works on a string that is already in memory. For big files we read large binary blocks and decode them
+# with an incremental decoder, which keeps the bytes of a multi-byte character cut at the end of a block for the next one
+# A chunk is only handed over at its last line break: a newline never combines with the characters around it, so a
+# base character and its combining marks are never split between two chunks
+# A file without line breaks would be held whole in memory, so after MAX_PENDING_BLOCKS blocks without one the chunk
+# is cut before its last starter (a character with combining class 0) that doesn't compose with the character before
+# unicodedata.is_normalized is a quick check in C: chunks that are already in the target form are written as they are,
+# and the others are normalized in a pool of processes (keeping at most 2 chunks per worker in flight)
+import codecs
+import collections
+import os
+import tempfile
+import unicodedata
+from concurrent import futures
+
+CHUNK_SIZE = 8 * 1024 * 1024
+MAX_PENDING_BLOCKS = 4
+
+def starter_cut(text, form='NFC', limit=1024):
+    """Index of the last safe cut for form in the final limit characters of text, or 0 if there is none"""
+    for i in range(len(text) - 1, max(len(text) - limit, 0), -1):
+        char, before = text[i], text[i-1]
+        # The character and the first character of its decomposition must be starters: U+FF9E has combining class 0,
+        # but NFKD turns it into U+3099, which combines. And a starter only composes with the character just before
+        # it (a combining mark in between blocks it)
+        if not unicodedata.combining(char) and not unicodedata.combining(normalize('NFKD', char)[0]) and \
+                normalize(form, before + char) == normalize(form, before) + normalize(form, char):
+            return i
+    return 0
+
+def iter_text_chunks(path, encoding='utf-8', chunk_size=CHUNK_SIZE, form='NFC'):
+    """Yield the decoded text of the file in chunks that end after a line break, or before a safe starter
+    (a cut that doesn't change the normalization to form) if there is no line break in MAX_PENDING_BLOCKS blocks"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(chunk_size), b''):
+            text = pending + decoder.decode(block)
+            cut = text.rfind('\n') + 1
+            if not cut and len(text) > MAX_PENDING_BLOCKS * chunk_size:
+                cut = starter_cut(text, form)
+            if cut:
+                yield text[:cut]
+            pending = text[cut:]
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+def normalize_chunk(form, text):
+    return normalize(form, text)
+
+def normalize_file(source, target, form='NFC', encoding='utf-8', chunk_size=CHUNK_SIZE, workers=None):
+    """Write the text of source normalized to form into target (always UTF-8).
+    Returns how many chunks were read and how many of them were already normalized"""
+    workers = workers or os.cpu_count()
+    chunks = skipped = 0
+    in_flight = collections.deque()
+    with open(target, 'w', encoding='utf-8', newline='') as out, \
+            futures.ProcessPoolExecutor(workers) as executor:
+        for text in iter_text_chunks(source, encoding, chunk_size, form):
+            chunks += 1
+            if unicodedata.is_normalized(form, text):
+                skipped += 1
+                in_flight.append(text)
+            else:
+                in_flight.append(executor.submit(normalize_chunk, form, text))
+            # Write in order, and don't let the pending chunks grow without limit
+            while in_flight and (len(in_flight) > 2 * workers or isinstance(in_flight[0], str)):
+                item = in_flight.popleft()
+                out.write(item if isinstance(item, str) else item.result())
+        for item in in_flight:
+            out.write(item if isinstance(item, str) else item.result())
+    return chunks, skipped
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        source, target = os.path.join(tmp, 'in.txt'), os.path.join(tmp, 'out.txt')
+        with open(source, 'w', encoding='utf-8') as fp:
+            fp.write('café com açaí\n' * 1000 + 'plain text\n' * 1000)
+        print(normalize_file(source, target, chunk_size=4096))
+        with open(target, encoding='utf-8') as fp:
+            print(fp.read() == normalize('NFC', 'café com açaí\n' * 1000 + 'plain text\n' * 1000))
+
 
 # Function to remove all combining marks
 # Sometimes this piece of code will generate a couple of errors, because it can normalize greek letters in a wrong way
@@ -108,6 +192,81 @@ def shave_marks_latin(txt):
     shaved = ''.join(keepers)
     return unicodedata.normalize('NFC', shaved)
 
+# A faster way to shave the marks, with the same output as the functions above
+# Both functions normalize the whole text twice and call unicodedata.combining for every character in a Python loop
+# MarkShaver avoids that work in the common cases:
+# - ASCII text has no marks, so it is returned as is
+# - Text made only of ASCII and Latin characters (Latin-1 Supplement and Latin Extended A/B) uses str.translate
+#   with a table built once, by running the original function on each of these characters
+# - Anything else (Greek, combining marks already decomposed, etc.) goes to the original function, behind an LRU cache
+import functools
+import random
+import time
+
+class MarkShaver:
+    """Callable with the same results as shave_marks, or shave_marks_latin with latin_only=True"""
+    TABLE_RANGE = range(0x80, 0x250)
+
+    def __init__(self, latin_only=False, cache_size=4096):
+        self.reference = shave_marks_latin if latin_only else shave_marks
+        self._table = {}
+        safe = set(map(chr, range(128)))
+        for code in self.TABLE_RANGE:
+            char = chr(code)
+            shaved = self.reference(char)
+            # A character can only be translated alone if neither it nor its result has combining marks
+            if unicodedata.combining(char) or any(map(unicodedata.combining, shaved)):
+                continue
+            safe.add(char)
+            if shaved != char:
+                self._table[code] = shaved
+        self._safe = frozenset(safe)
+        self._cached = functools.lru_cache(maxsize=cache_size)(self._shave)
+
+    def _shave(self, txt):
+        if self._safe.issuperset(txt):
+            return txt.translate(self._table)
+        return self.reference(txt)
+
+    def __call__(self, txt):
+        if txt.isascii():
+            return txt
+        return self._cached(txt)
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+def shave_texts(count, letters):
+    """count distinct texts of words made of letters, so no result comes from the LRU cache"""
+    rng = random.Random(1729)
+    return ['%s %d' % (' '.join(''.join(rng.choice(letters) for _ in range(6)) for _ in range(4)), i)
+            for i in range(count)]
+
+def bench_shave(count=20_000):
+    """Compare shave_marks and shave_marks_latin with MarkShaver on each path, with distinct texts and no cache"""
+    paths = [
+        ('ascii', shave_texts(count, string.ascii_letters)),
+        ('translate', shave_texts(count, 'aeiouçãáéíóúàèìòùâêîôûäëïöüñßøåæœ')),
+        ('fallback', shave_texts(count, 'αβγδεζέάίόύήώϊϋΐΰ')),
+    ]
+    for latin_only, reference in ((False, shave_marks), (True, shave_marks_latin)):
+        shaver = MarkShaver(latin_only, cache_size=0)
+        for path, texts in paths:
+            t0 = time.perf_counter()
+            expected = [reference(txt) for txt in texts]
+            reference_time = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            shaved = [shaver(txt) for txt in texts]
+            shaver_time = time.perf_counter() - t0
+            assert shaved == expected
+            print('%-18s %-10s %8.3fs, MarkShaver %8.3fs (%.1fx)'
+                  % (reference.__name__, path, reference_time, shaver_time, reference_time / shaver_time))
+
+shave = MarkShaver()
+if __name__ == '__main__':
+    print(shave(order) == shave_marks(order), shave(order))
+    bench_shave()
+
 # Sorting unicode text
 # Using the locale.strxfrm function as sort key
 # This will ignore the accents when sorting the list
@@ -122,4 +281,180 @@ print(sorted_fruits)
 import pyuca
 coll = pyuca.Collator()
 fruits = ['caju', 'atemoia', 'cajá', 'açaí', 'acerola']
-sorted_fruits = sorted(fruits, key=coll.sort_key)
\ No newline at end of file
+sorted_fruits = sorted(fruits, key=coll.sort_key)
+
+# A cache of collation keys
+# pyuca computes the keys in pure Python, which is slow for big lists, and strxfrm needs setlocale, which changes
+# the locale of the whole process (not safe when other threads are running)
+# CollationService stores each key as bytes in a sqlite database, keyed by (collation, string), so each key is computed
+# only once. The pyuca keys are packed as big endian 16 bit numbers (the DUCET weights fit in 16 bits), and the strxfrm
+# keys are encoded in UTF-8: in both cases comparing the bytes gives the same order as comparing the original keys
+# strxfrm keys are always computed in worker processes that call setlocale once at start, so the locale of this
+# process is never touched. Big lists of missing keys are also computed in parallel
+import sqlite3
+import struct
+import threading
+
+_worker_sort_key = None
+
+def make_sort_key(collation):
+    """Return a function text -> bytes for 'pyuca' or 'strxfrm:<locale name>'"""
+    if collation == 'pyuca':
+        collator = pyuca.Collator()
+        def sort_key(text):
+            weights = collator.sort_key(text)
+            return struct.pack('>%dH' % len(weights), *weights)
+        return sort_key
+    if collation.startswith('strxfrm:'):
+        locale.setlocale(locale.LC_COLLATE, collation.split(':', 1)[1])
+        return lambda text: locale.strxfrm(text).encode('utf-8', 'surrogatepass')
+    raise ValueError('unknown collation %r' % collation)
+
+def _init_worker(collation):
+    global _worker_sort_key
+    _worker_sort_key = make_sort_key(collation)
+
+def _compute_keys(texts):
+    return [_worker_sort_key(text) for text in texts]
+
+class CollationService:
+    def __init__(self, path=':memory:', collation='pyuca', workers=None, parallel_threshold=100_000):
+        self.collation = collation
+        self.workers = workers or os.cpu_count()
+        self.parallel_threshold = parallel_threshold
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS sort_keys '
+                         '(collation TEXT, string TEXT, key BLOB, PRIMARY KEY (collation, string))')
+        self._executor = None
+        self._local_sort_key = None
+
+    def _cached(self, texts):
+        found = {}
+        with self._lock:
+            for start in range(0, len(texts), 500):
+                batch = texts[start:start+500]
+                query = 'SELECT string, key FROM sort_keys WHERE collation = ? AND string IN (%s)' % ','.join('?' * len(batch))
+                found.update(self._db.execute(query, [self.collation, *batch]))
+        return found
+
+    def _compute(self, texts):
+        if self.collation == 'pyuca' and len(texts) < self.parallel_threshold:
+            if self._local_sort_key is None:
+                self._local_sort_key = make_sort_key(self.collation)
+            return list(map(self._local_sort_key, texts))
+        with self._lock:
+            if self._executor is None:
+                self._executor = futures.ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                             initargs=(self.collation,))
+        size = max(1, -(-len(texts) // self.workers))
+        chunks = [texts[start:start+size] for start in range(0, len(texts), size)]
+        return [key for keys in self._executor.map(_compute_keys, chunks) for key in keys]
+
+    def sort_keys(self, iterable):
+        """Return the sort key (bytes) of every string, computing and storing only the ones not in the cache"""
+        texts = list(iterable)
+        keys = self._cached(list(set(texts)))
+        missing = [text for text in set(texts) if text not in keys]
+        if missing:
+            computed = self._compute(missing)
+            keys.update(zip(missing, computed))
+            with self._lock, self._db:
+                self._db.executemany('INSERT OR IGNORE INTO sort_keys VALUES (?, ?, ?)',
+                                     [(self.collation, text, key) for text, key in zip(missing, computed)])
+        return [keys[text] for text in texts]
+
+    def sort_key(self, text):
+        return self.sort_keys([text])[0]
+
+    def sorted(self, iterable, reverse=False):
+        texts = list(iterable)
+        keys = self.sort_keys(texts)
+        order = sorted(range(len(texts)), key=keys.__getitem__, reverse=reverse)
+        return [texts[i] for i in order]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        self._db.close()
+
+if __name__ == '__main__':
+    collation_service = CollationService(collation='pyuca')
+    print(collation_service.sorted(fruits) == sorted(fruits, key=coll.sort_key))
+    collation_service.close()
+
+# Detecting the encoding of mixed feeds and transcoding them to UTF-8
+# Example 1 shows 'café' in ISO-8859-1, UTF-8 and cp1252. To guess which one a byte stream uses:
+# - bytes.isascii is a fast scan in C: ASCII is valid in the three encodings
+# - UTF-8 is very strict: random latin-1 or cp1252 text with accents almost never decodes as valid UTF-8.
+#   An incremental decoder is used so a multi-byte character cut at the end of the sample is not an error
+# - Otherwise, bytes 0x80-0x9F are control characters in latin-1 but printable in cp1252 (€, curly quotes), so the
+#   text is cp1252 unless it has one of the 5 bytes that cp1252 doesn't define
+# transcode reads the input in blocks, so memory stays bounded by the block size. If the stream stops being valid
+# UTF-8 (or cp1252) after the sample, the valid part is kept and the rest is decoded with the fallback encoding
+import io
+import itertools
+import time
+
+SAMPLE_SIZE = 64 * 1024
+
+def legacy_encoding(data):
+    try:
+        data.decode('cp1252')
+    except UnicodeDecodeError:
+        return 'latin-1'
+    return 'cp1252'
+
+def detect_encoding(sample, final=False):
+    """Guess between 'ascii', 'utf-8', 'cp1252' and 'latin-1' from a sample of bytes.
+    final=True means the sample is the whole input, so a sequence cut at the end is an error"""
+    if sample.isascii():
+        return 'ascii'
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final)
+    except UnicodeDecodeError:
+        return legacy_encoding(sample)
+    return 'utf-8'
+
+def transcode(source, target, encoding=None, chunk_size=CHUNK_SIZE):
+    """Copy the binary file object source to target in UTF-8. Returns the list of encodings used"""
+    read_size = max(chunk_size, SAMPLE_SIZE)
+    first = source.read(read_size)
+    if encoding is None:
+        # A short read means the sample is the whole input
+        encoding = detect_encoding(first[:SAMPLE_SIZE], final=len(first) < read_size)
+        if encoding == 'ascii':
+            encoding = 'utf-8'  # the rest of the file may have non-ASCII characters
+    used = [encoding]
+    decoder = codecs.getincrementaldecoder(encoding)()
+    blocks = itertools.chain([first], iter(lambda: source.read(chunk_size), b''))
+    for block, final in itertools.chain(((block, False) for block in blocks), [(b'', True)]):
+        while True:
+            try:
+                text = decoder.decode(block, final)
+                break
+            except UnicodeDecodeError as exc:
+                # exc.object has the bytes kept by the decoder plus the block, exc.start is where the error is
+                # The valid part is decoded with the encoding that failed, then the rest is decoded again with the
+                # fallback: cp1252 or latin-1 after UTF-8, latin-1 after cp1252 (latin-1 decodes any byte)
+                target.write(exc.object[:exc.start].decode(used[-1]).encode('utf-8'))
+                block = exc.object[exc.start:]
+                used.append(legacy_encoding(block) if used[-1] == 'utf-8' else 'latin-1')
+                decoder = codecs.getincrementaldecoder(used[-1])()
+        target.write(text.encode('utf-8'))
+    return used
+
+def bench_transcode(size_mb=20):
+    """Show the throughput of transcode in MB/s for text in each encoding"""
+    line = '“Herr Voß: • ½ cup of Œtker™ caffè latte • bowl of açaí.”\n'
+    for encoding in ('utf-8', 'cp1252', 'latin-1'):
+        data = line.encode(encoding, 'replace') * (size_mb * 1024 * 1024 // len(line))
+        t0 = time.perf_counter()
+        used = transcode(io.BytesIO(data), io.BytesIO())
+        elapsed = time.perf_counter() - t0
+        print('%-8s -> %-10s %8.1f MB/s' % (encoding, '/'.join(used), len(data) / elapsed / 1024 / 1024))
+
+if __name__ == '__main__':
+    for encoding in ('ISO-8859-1', 'utf-8', 'cp1252'):
+        print(encoding, detect_encoding('café €'.encode(encoding, 'replace'), final=True))
+    bench_transcode()
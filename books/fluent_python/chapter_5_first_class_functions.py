@@ -87,4 +87,352 @@ print(metro_areas[0].coord.lat)
 from operator import attrgetter
 name_lat = attrgetter('name', 'coord.lat') #Define an attrgetter to retrieve the name and the coord.lat nested attribute
 for city in sorted(metro_areas, key=attrgetter('coord.lat')): #Use attrgetter again to sort list of cities by latitude
-    print(name_lat(city)) #Use the attrgetter defined to show only city name and latitude
\ No newline at end of file
+    print(name_lat(city)) #Use the attrgetter defined to show only city name and latitude
+
+# Example: A struct of arrays for lists of namedtuples
+# A list of Metropolis keeps one tuple per city, and each field of each tuple is a separate boxed object
+# RecordTable uses the same field names, but stores each field as a column: numbers go to an array (floats to
+# array('d'), ints to array('q')) and anything else to a list. An int column that gets a float becomes a float array,
+# and a column that gets a value its array can't hold (a big int, a string) becomes a list. Nested namedtuples like LatLong are flattened
+# into dotted columns ('coord.lat', 'coord.long')
+# Indexing the table returns a light view that reads the columns on demand, so attrgetter('name', 'coord.lat')
+# still works, and sorting uses an argsort over the columns instead of building the rows
+from array import array
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class RowView:
+    """A row of a RecordTable: reads the fields from the columns of the table"""
+    __slots__ = ('_table', '_index', '_prefix')
+
+    def __init__(self, table, index, prefix=''):
+        self._table = table
+        self._index = index
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        path = self._prefix + name
+        table = self._table
+        if path in table.columns:
+            return table.columns[path][self._index]
+        if path in table.nested:
+            return RowView(table, self._index, path + '.')
+        raise AttributeError('%r row has no attribute %r' % (table.record_type.__name__, path))
+
+    def as_record(self):
+        """Build the namedtuple of this row"""
+        record_type = self._table.nested.get(self._prefix[:-1], self._table.record_type)
+        values = (getattr(self, name) for name in record_type._fields)
+        return record_type._make(value.as_record() if isinstance(value, RowView) else value for value in values)
+
+    def __repr__(self):
+        return 'RowView(%r)' % (self.as_record(),)
+
+# Ints beyond 2**53 can't be stored in a float without losing digits
+MAX_EXACT_FLOAT_INT = 2**53
+
+def _new_column(value):
+    if isinstance(value, float):
+        return array('d')
+    if isinstance(value, int) and not isinstance(value, bool) and -2**63 <= value < 2**63:
+        return array('q')
+    return []
+
+def _fits(column, value):
+    if isinstance(column, list):
+        return True
+    if isinstance(value, bool):
+        return False
+    if column.typecode == 'q':
+        return isinstance(value, int) and -2**63 <= value < 2**63
+    return isinstance(value, float) or (isinstance(value, int) and abs(value) <= MAX_EXACT_FLOAT_INT)
+
+def _promote(column, value):
+    """Return a column that holds the values of column and value: an int array becomes a float array if
+    every int is exact as a float, anything else becomes a list"""
+    if (column.typecode == 'q' and isinstance(value, float)
+            and all(abs(item) <= MAX_EXACT_FLOAT_INT for item in column)):
+        return array('d', column)
+    return list(column)
+
+class RecordTable:
+    """Column store for records of a namedtuple type; nested maps a field name to its namedtuple type"""
+    def __init__(self, record_type, records=(), nested=None):
+        self.record_type = record_type
+        self.nested = dict(nested or {})
+        self.columns = None
+        self._size = 0
+        for record in records:
+            self.append(record)
+
+    def _flatten(self, record, record_type, prefix=''):
+        for name, value in zip(record_type._fields, record):
+            path = prefix + name
+            if path in self.nested:
+                yield from self._flatten(value, self.nested[path], path + '.')
+            else:
+                yield path, value
+
+    def append(self, record):
+        fields = list(self._flatten(record, self.record_type))
+        if self.columns is None:
+            # The type of each column is chosen from the first record, and changed later if a value doesn't fit
+            self.columns = {path: _new_column(value) for path, value in fields}
+        for path, value in fields:
+            column = self.columns[path]
+            if not _fits(column, value):
+                column = self.columns[path] = _promote(column, value)
+            column.append(value)
+        self._size += 1
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('RecordTable index out of range')
+        return RowView(self, index)
+
+    def __iter__(self):
+        return (RowView(self, index) for index in range(self._size))
+
+    def argsort(self, *paths, reverse=False):
+        """Return the row indexes ordered by the given columns, like sorted(rows, key=attrgetter(*paths))"""
+        if numpy is not None and len(paths) == 1 and isinstance(self.columns[paths[0]], array):
+            # numpy.frombuffer shares the memory of the array, nothing is copied
+            column = self.columns[paths[0]]
+            values = numpy.frombuffer(column, dtype=column.typecode)
+            # Negating instead of reversing the result keeps ties in their original order, like sort(reverse=True)
+            return numpy.argsort(-values if reverse else values, kind='stable').tolist()
+        order = list(range(self._size))
+        # Sorting by the last key first works because Python sorts are stable
+        for path in reversed(paths):
+            order.sort(key=self.columns[path].__getitem__, reverse=reverse)
+        return order
+
+    def sorted_rows(self, *paths, reverse=False):
+        return [RowView(self, index) for index in self.argsort(*paths, reverse=reverse)]
+
+    def take(self, indexes):
+        """Return a new table with the rows in the order of indexes"""
+        table = RecordTable(self.record_type, nested=self.nested)
+        table.columns = {path: array(column.typecode, map(column.__getitem__, indexes))
+                         if isinstance(column, array) else list(map(column.__getitem__, indexes))
+                         for path, column in self.columns.items()}
+        table._size = len(indexes)
+        return table
+
+metro_table = RecordTable(Metropolis, metro_areas, nested={'coord': LatLong})
+for city in metro_table.sorted_rows('coord.lat'):
+    print(name_lat(city))
+
+# Example: Caching sort keys between sorts
+# sorted(metro_data, key=itemgetter(1)) calls the key function again for every record on every sort, which is
+# expensive for keys like locale.strxfrm or pyuca's coll.sort_key (chapter 4)
+# SortService computes the keys of each key spec once and keeps them: an int spec means itemgetter, a str spec
+# means attrgetter (so 'coord.lat' works) and any other callable is used as is. Compound keys are sorted from the
+# last key to the first, relying on the stability of the sort, which also allows mixing ascending and desc() keys
+# Sorting in a pool of processes does not pay off here: the keys have to be pickled to the workers and the sorted
+# chunks merged back in Python, which costs more than the whole sort of the cached keys in C
+import time
+import unicodedata
+
+class desc:
+    """Marks a key spec as descending, e.g. SortService(metro_areas).sort('cc', desc('pop'))"""
+    def __init__(self, spec):
+        self.spec = spec
+
+class SortService:
+    def __init__(self, records):
+        self.records = list(records)
+        self._keys = {}
+
+    def keys(self, spec):
+        """Return the cached list of keys of every record for the spec"""
+        if spec not in self._keys:
+            if isinstance(spec, int):
+                key = itemgetter(spec)
+            elif isinstance(spec, str):
+                key = attrgetter(spec)
+            else:
+                key = spec
+            self._keys[spec] = [key(record) for record in self.records]
+        return self._keys[spec]
+
+    def invalidate(self):
+        """Forget the cached keys, needed after the records change"""
+        self._keys.clear()
+
+    def argsort(self, *specs):
+        order = list(range(len(self.records)))
+        for spec in reversed(specs):
+            descending = isinstance(spec, desc)
+            column = self.keys(spec.spec if descending else spec)
+            order.sort(key=column.__getitem__, reverse=descending)
+        return order
+
+    def sort(self, *specs):
+        return [self.records[index] for index in self.argsort(*specs)]
+
+def folded(text):
+    """An expensive key: compatibility decomposition without accents, casefolded"""
+    return ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char)).casefold()
+
+def bench_sort(size=200_000, sorts=5):
+    """Sort the same records several times with sorted(key=...) and with SortService"""
+    random.seed(1729)
+    letters = 'aeiouáéíóúçñbcdfgABCDÉÖ'
+    records = [(''.join(random.choice(letters) for _ in range(8)), random.randrange(1000)) for _ in range(size)]
+    by_name = lambda record: folded(record[0])
+    t0 = time.perf_counter()
+    for _ in range(sorts):
+        expected = sorted(records, key=by_name)
+    sorted_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    service = SortService(records)
+    for _ in range(sorts):
+        result = service.sort(by_name)
+    service_time = time.perf_counter() - t0
+    assert result == expected
+    print('%d records, %d sorts: sorted %.3fs, SortService %.3fs (%.1fx)'
+          % (size, sorts, sorted_time, service_time, sorted_time / service_time))
+
+if __name__ == '__main__':
+    metro_service = SortService(metro_areas)
+    print(SortService(metro_data).sort(1) == sorted(metro_data, key=itemgetter(1)))
+    print([city.name for city in metro_service.sort('coord.lat')])
+    print([(city.cc, city.pop) for city in metro_service.sort(desc('pop'))])
+    print(metro_service.sort('cc', desc('pop'))[:3])
+    bench_sort()
+
+# Example: Factorial and Fibonacci for big numbers
+# The recursive factorial above goes over the recursion limit near n=1000, and fibonacci (chapter 7) needs an
+# unbounded lru_cache to be fast. Python ints have no size limit, so what matters for big n is how the work is done:
+# - factorial_iterative is a plain loop, with no recursion limit
+# - factorial_split multiplies the numbers in halves (binary splitting), so most multiplications are between numbers
+#   of similar size, which is much faster for big ints (math.factorial uses the same idea, written in C)
+# - fibonacci_doubling uses F(2k) = F(k) * (2*F(k+1) - F(k)) and F(2k+1) = F(k)**2 + F(k+1)**2, so it needs
+#   about log2(n) steps instead of n
+# - factorial_many/fibonacci_many compute a batch like map(factorial, range(11)) reusing the previous result
+# - ResultCache is a bounded LRU cache, a callable object that can decorate many functions and be shared by them
+import collections
+import functools
+import math
+import threading
+import time
+
+def _check(n):
+    if not isinstance(n, int) or n < 0:
+        raise ValueError('n must be a non negative int, not %r' % (n,))
+
+def factorial_iterative(n):
+    _check(n)
+    result = 1
+    for i in range(2, n + 1):
+        result *= i
+    return result
+
+def _product(low, high):
+    """Product of the numbers in range(low, high)"""
+    if high - low < 16:
+        result = 1
+        for i in range(low, high):
+            result *= i
+        return result
+    middle = (low + high) // 2
+    return _product(low, middle) * _product(middle, high)
+
+def factorial_split(n):
+    _check(n)
+    return _product(2, n + 1)
+
+def fibonacci_doubling(n):
+    _check(n)
+    a, b = 0, 1  # F(k), F(k+1), starting with k=0
+    for bit in bin(n)[2:]:
+        a, b = a * (2 * b - a), a * a + b * b  # k -> 2k
+        if bit == '1':
+            a, b = b, a + b  # 2k -> 2k+1
+    return a
+
+def factorial_many(numbers):
+    """Return [n! for n in numbers], multiplying only from one requested n to the next"""
+    numbers = list(numbers)
+    results = {}
+    n, value = 0, 1
+    for target in sorted(set(numbers)):
+        _check(target)
+        value *= _product(n + 1, target + 1)
+        n = target
+        results[n] = value
+    return [results[n] for n in numbers]
+
+def fibonacci_many(numbers):
+    """Return [F(n) for n in numbers], walking the sequence once up to the biggest n"""
+    numbers = list(numbers)
+    wanted = set(numbers)
+    results = {}
+    a, b = 0, 1
+    for n in range(max(wanted, default=-1) + 1):
+        if n in wanted:
+            results[n] = a
+        a, b = b, a + b
+    return [results[n] for n in numbers]
+
+class ResultCache:
+    """A bounded LRU cache of results, shared by every function it decorates"""
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def cached(n):
+            key = (func.__qualname__, n)
+            with self._lock:
+                if key in self._data:
+                    self.hits += 1
+                    self._data.move_to_end(key)
+                    return self._data[key]
+                self.misses += 1
+            result = func(n)
+            with self._lock:
+                self._data[key] = result
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+            return result
+        return cached
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+math_cache = ResultCache(maxsize=128)
+cached_factorial = math_cache(factorial_split)
+cached_fibonacci = math_cache(fibonacci_doubling)
+
+def bench_math(sizes=(10**3, 10**5, 10**6), slow_limit=10**5):
+    """Time the functions above for each n; the linear ones are skipped above slow_limit"""
+    functions = [('math.factorial', math.factorial, 0), ('factorial_iterative', factorial_iterative, slow_limit),
+                 ('factorial_split', factorial_split, 0), ('fibonacci_many', lambda n: fibonacci_many([n])[0], slow_limit),
+                 ('fibonacci_doubling', fibonacci_doubling, 0)]
+    for n in sizes:
+        for label, function, limit in functions:
+            if limit and n > limit:
+                print('%-20s n=%-8d skipped' % (label, n))
+                continue
+            t0 = time.perf_counter()
+            function(n)
+            print('%-20s n=%-8d %10.4fs' % (label, n, time.perf_counter() - t0))
+
+print(factorial_many(range(11)) == list(map(factorial, range(11))))
+print(fibonacci_many(range(11)) == list(map(fibonacci_doubling, range(11))))
+if __name__ == '__main__':
+    bench_math()
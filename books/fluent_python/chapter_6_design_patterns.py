@@ -16,30 +16,121 @@
 # Example of the usage of the classic strategy
 from abc import ABC, abstractmethod
 from collections import namedtuple
+import functools
 import inspect
+import weakref
 Customer = namedtuple('Customer', 'name fidelity')
+BULK_QUANTITY = 20
 
 class LineItem:
     def __init__(self, product, quantity, price):
+        self._orders = weakref.WeakSet() # orders whose cart has this item
         self.product = product
         self.quantity = quantity
         self.price = price
 
+    # Any change of product, quantity or price makes the orders with this item compute their totals again
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name != '_orders':
+            for order in self._orders:
+                order.invalidate()
+
+    # The links to the orders are not pickled: they are rebuilt when the order that has the item is unpickled
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_orders']
+        return state
+
+    def __setstate__(self, state):
+        super().__setattr__('_orders', weakref.WeakSet())
+        self.__dict__.update(state)
+
     def total(self):
         return self.price * self.quantity
-    
+
+class Cart(list):
+    """A list of LineItem that tells its order when it changes"""
+    def __init__(self, order, items=()):
+        super().__init__(items)
+        self.order = order
+        self._changed()
+
+    def _changed(self):
+        for item in self:
+            item._orders.add(self.order)
+        self.order.invalidate()
+
+    def __reduce__(self):
+        return type(self), (self.order, list(self))
+
+def _changes_cart(method):
+    @functools.wraps(method)
+    def changed(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._changed()
+        return result
+    return changed
+
+for method_name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse',
+             '__setitem__', '__delitem__', '__iadd__', '__imul__'):
+    setattr(Cart, method_name, _changes_cart(getattr(list, method_name)))
+
+# The aggregates that the promotions need, computed in a single pass over the cart
+CartTotals = namedtuple('CartTotals', 'total distinct_products bulk_subtotal')
+
 class Order: 
     """ The Context: Provides a service by delegating some computation to interchangeable components
         that implement alternative algorithms """
     def __init__(self, customer, cart, promotion=None):
         self.customer = customer
-        self.cart = list(cart)
+        self._totals = None
+        self.cart = cart
         self.promotion = promotion
 
+    @property
+    def cart(self):
+        return self._cart
+
+    @cart.setter
+    def cart(self, items):
+        self._cart = Cart(self, items)
+
+    def invalidate(self):
+        self._totals = None
+
+    # The cart is pickled as a plain list and the cached totals are dropped, so orders can be sent to other processes
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_totals'] = None
+        if '_cart' in state:
+            state['_cart'] = list(state['_cart'])
+        return state
+
+    def __setstate__(self, state):
+        cart = state.pop('_cart', None)
+        self.__dict__.update(state)
+        if cart is not None:
+            self.cart = cart
+
+    # The old version cached the total with hasattr(self, '__total'), but inside the class self.__total is stored
+    # as _Order__total, so the check never found it and the sum was done on every call
+    def totals(self):
+        """Return the CartTotals, kept until the cart or one of its items changes"""
+        if self._totals is None:
+            total = bulk_subtotal = 0
+            products = set()
+            for item in self.cart:
+                item_total = item.total()
+                total += item_total
+                products.add(item.product)
+                if item.quantity >= BULK_QUANTITY:
+                    bulk_subtotal += item_total
+            self._totals = CartTotals(total, len(products), bulk_subtotal)
+        return self._totals
+
     def total(self):
-        if not hasattr(self, '__total'):
-            self.__total = sum(item.total() for item in self.cart)
-        return self.__total
+        return self.totals().total
     
     def due(self):
         if self.promotion is None:
@@ -65,11 +156,187 @@ class FidelityPromo(Promotion): # first Concrete Strategy
 class BulkItemPromo(Promotion): # second Concrete Strategy
     """10% discount for each LineItem with 20 or more units"""
     def discount(self, order):
-        discount = 0
-        for item in order.cart:
-            if item.quantity >= 20:
-                discount += item.total() * .1
-        return discount
+        return order.totals().bulk_subtotal * .1
+
+# Pricing many orders at once
+# Order.total() adds the LineItem objects one by one, and BulkItemPromo walks the cart again. To price millions of
+# cart lines, PricingEngine keeps every line of every order in flat columns (order index, product code, quantity and
+# price arrays) and computes the totals and discounts of all the orders in a few passes over the columns
+# With NumPy each pass is a bincount over the order indexes; without it, the lines of each order are a slice added
+# with sum(), which runs in C
+# The Order/Promotion API keeps working: engine.order(i) returns an OrderView with customer, cart, total() and due(),
+# and FidelityPromo/BulkItemPromo read their discount from the engine columns instead of walking the cart
+from array import array
+import operator
+import random
+import time
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class PricingEngine:
+    def __init__(self):
+        self.customers = []
+        self.order_ids = array('q')
+        self.order_starts = array('q')  # index of the first line of each order
+        self.product_codes = array('q')
+        self.quantities = array('q')
+        self.prices = array('d')
+        self.products = []  # product code -> product name
+        self._product_codes = {}
+        self._columns = {}
+
+    @classmethod
+    def from_orders(cls, orders):
+        engine = cls()
+        for order in orders:
+            engine.add_order(order.customer, order.cart)
+        return engine
+
+    def add_order(self, customer, cart):
+        """Add an order (any iterable of LineItem) and return its index"""
+        order_id = len(self.customers)
+        self.customers.append(customer)
+        self.order_starts.append(len(self.order_ids))
+        for item in cart:
+            code = self._product_codes.get(item.product)
+            if code is None:
+                code = self._product_codes[item.product] = len(self.products)
+                self.products.append(item.product)
+            self.order_ids.append(order_id)
+            self.product_codes.append(code)
+            self.quantities.append(item.quantity)
+            self.prices.append(item.price)
+        self._columns.clear()
+        return order_id
+
+    def __len__(self):
+        return len(self.customers)
+
+    def _column(self, name, compute):
+        # Computed columns are kept until the next add_order
+        if name not in self._columns:
+            self._columns[name] = compute()
+        return self._columns[name]
+
+    def _sum_by_order(self, line_values):
+        """Add the values of the lines of each order"""
+        if numpy is not None:
+            return numpy.bincount(numpy.frombuffer(self.order_ids, dtype=numpy.int64),
+                                  weights=line_values, minlength=len(self)).tolist()
+        # The lines of each order are contiguous, so each order is a slice added by sum() in C
+        ends = self.order_starts[1:].tolist() + [len(self.order_ids)]
+        return [sum(line_values[start:end]) for start, end in zip(self.order_starts, ends)]
+
+    def line_totals(self):
+        if numpy is not None:
+            return self._column('line_totals', lambda: numpy.frombuffer(self.prices, dtype=numpy.float64) *
+                                numpy.frombuffer(self.quantities, dtype=numpy.int64))
+        return self._column('line_totals', lambda: list(map(operator.mul, self.prices, self.quantities)))
+
+    def totals(self):
+        return self._column('totals', lambda: self._sum_by_order(self.line_totals()))
+
+    def fidelity_discounts(self):
+        """Same as FidelityPromo: 5% for customers with 1000 or more fidelity points"""
+        return self._column('fidelity', lambda: [total * .05 if customer.fidelity >= 1000 else 0
+                                                 for total, customer in zip(self.totals(), self.customers)])
+
+    def bulk_discounts(self):
+        """Same as BulkItemPromo: 10% of each line with 20 or more units"""
+        def compute():
+            if numpy is not None:
+                bulk = self.line_totals() * .1 * (numpy.frombuffer(self.quantities, dtype=numpy.int64) >= 20)
+            else:
+                bulk = [total * .1 if quantity >= 20 else 0
+                        for total, quantity in zip(self.line_totals(), self.quantities)]
+            return self._sum_by_order(bulk)
+        return self._column('bulk', compute)
+
+    def discounts(self, promotion):
+        """Discount of every order for the promotion (None means no promotion)"""
+        if promotion is None:
+            return [0] * len(self)
+        vectorized = VECTORIZED_PROMOTIONS.get(type(promotion))
+        if vectorized is not None:
+            return vectorized(self)
+        return [promotion.discount(self.order(i)) for i in range(len(self))]
+
+    def dues(self, promotion=None):
+        return [total - discount for total, discount in zip(self.totals(), self.discounts(promotion))]
+
+    def order(self, order_id, promotion=None):
+        return OrderView(self, order_id, promotion)
+
+class OrderView(Order):
+    """An Order whose numbers come from a PricingEngine"""
+    def __init__(self, engine, order_id, promotion=None):
+        self.engine = engine
+        self.order_id = order_id
+        self.customer = engine.customers[order_id]
+        self.promotion = promotion
+        self._totals = None
+
+    @property
+    def cart(self):
+        # The LineItem objects are only built if a promotion without a vectorized version needs them
+        # The lines of the order are contiguous, from its start to the start of the next order
+        engine = self.engine
+        start = engine.order_starts[self.order_id]
+        if self.order_id + 1 < len(engine):
+            end = engine.order_starts[self.order_id + 1]
+        else:
+            end = len(engine.order_ids)
+        return [LineItem(engine.products[engine.product_codes[i]], engine.quantities[i], engine.prices[i])
+                for i in range(start, end)]
+
+    def total(self):
+        return self.engine.totals()[self.order_id]
+
+    def due(self):
+        if self.promotion is None:
+            return self.total()
+        vectorized = VECTORIZED_PROMOTIONS.get(type(self.promotion))
+        if vectorized is None:
+            return self.total() - self.promotion.discount(self)
+        return self.total() - vectorized(self.engine)[self.order_id]
+
+VECTORIZED_PROMOTIONS = {
+    FidelityPromo: PricingEngine.fidelity_discounts,
+    BulkItemPromo: PricingEngine.bulk_discounts,
+}
+
+def bench_pricing(lines=10_000_000, compare_up_to=1_000_000):
+    """Price the given number of cart lines with PricingEngine, and with Order objects when lines <= compare_up_to"""
+    random.seed(1729)
+    items = [LineItem('product%d' % i, random.choice((1, 5, 10, 20, 30)), random.randint(1, 100) / 10)
+             for i in range(1000)]
+    customers = [Customer('ann', 0), Customer('joe', 1100)]
+    orders = []
+    while lines > 0:
+        cart = random.sample(items, min(lines, random.randint(1, 20)))
+        orders.append(Order(random.choice(customers), cart, BulkItemPromo()))
+        lines -= len(cart)
+    engine = PricingEngine.from_orders(orders)
+    t0 = time.perf_counter()
+    dues = engine.dues(BulkItemPromo())
+    print('%d lines, PricingEngine: %.2fs' % (len(engine.order_ids), time.perf_counter() - t0))
+    if len(engine.order_ids) <= compare_up_to:
+        t0 = time.perf_counter()
+        expected = [order.due() for order in orders]
+        print('%d lines, Order objects: %.2fs' % (len(engine.order_ids), time.perf_counter() - t0))
+        assert all(abs(a - b) < 1e-6 for a, b in zip(dues, expected))
+
+joe = Customer('John Doe', 0)
+ann = Customer('Ann Smith', 1100)
+cart = [LineItem('banana', 4, .5), LineItem('apple', 10, 1.5), LineItem('watermellon', 5, 5.0)]
+banana_cart = [LineItem('banana', 30, .5), LineItem('apple', 10, 1.5)]
+engine = PricingEngine.from_orders([Order(joe, cart), Order(ann, cart), Order(joe, banana_cart)])
+print(engine.totals(), engine.dues(FidelityPromo()), engine.dues(BulkItemPromo()))
+print(engine.order(1, FidelityPromo()), Order(ann, cart, FidelityPromo()))
+if __name__ == '__main__':
+    bench_pricing()
 
 # The module globals return a dictionary representing the current global symbol table  
 # This is always the dictionary of the current module (inside a function or method, this is the module where it is defined, not the module from which it is called)
@@ -77,4 +344,7 @@ class BulkItemPromo(Promotion): # second Concrete Strategy
 promos = [globals()[name] for name in globals() if name.endswith('_promo') and name != 'best_promo'] 
 
 # Another way of getting the promo functions would be to place them inside a class and then inspecting the modules of that class
-promos = [func for name, func in inspect.getmembers(promotions, inspect.isfunction)]
\ No newline at end of file
+promos = [func for name, func in inspect.getmembers(promotions, inspect.isfunction)]
+
+# Both ways scan the names again every time they run and need the modules already imported; chapter 7 (Example 12)
+# keeps the promotions in a registry that imports the promotion modules lazily and caches the active ones
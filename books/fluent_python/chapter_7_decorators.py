@@ -194,4 +194,695 @@ def main():
     f1()
 
 if __name__=='__main__':
-    main()
\ No newline at end of file
+    main()
+
+# Example 8: A clock decorator cheap enough to leave on in production
+# clock (Example 4) uses time.time(), builds the repr of every argument and prints on every call, so it can cost more
+# than the function it measures. profiled only does a few integer operations per call:
+# - time.perf_counter_ns returns an int in nanoseconds, with no float rounding
+# - the stats of each function (calls, total, min, max) are kept in a FunctionStats object with __slots__
+# - the latencies go to a histogram preallocated as an array of unsigned ints, with log-linear buckets (like HDR
+#   histograms): 8 buckets for each power of 2, so each bucket is precise to about 12%
+# - with sample_every=N only one call in N is timed, the others only increment the counter
+# Nothing is printed: snapshot() returns the numbers, and report_text()/report_json() format them
+# Note: counters are not protected by a lock, so a call may go uncounted when many threads run the same function
+import json
+from array import array
+
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HISTOGRAM_SIZE = 64 * SUB_BUCKETS
+
+def bucket_index(value):
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+def bucket_low(index):
+    """The smallest value that goes to the bucket"""
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+
+class FunctionStats:
+    __slots__ = ('name', 'calls', 'timed', 'total_ns', 'min_ns', 'max_ns', 'histogram')
+
+    def __init__(self, name):
+        self.name = name
+        self.histogram = array('Q', bytes(HISTOGRAM_SIZE * 8))
+        self.reset()
+
+    def reset(self):
+        self.calls = self.timed = self.total_ns = self.max_ns = 0
+        self.min_ns = None
+        for i in range(HISTOGRAM_SIZE):
+            self.histogram[i] = 0
+
+    def record(self, elapsed):
+        self.timed += 1
+        self.total_ns += elapsed
+        if self.min_ns is None or elapsed < self.min_ns:
+            self.min_ns = elapsed
+        if elapsed > self.max_ns:
+            self.max_ns = elapsed
+        self.histogram[bucket_index(elapsed)] += 1
+
+    def percentile(self, percent):
+        """Lower bound of the bucket where the percentile falls"""
+        wanted = self.timed * percent / 100
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= wanted:
+                return bucket_low(index)
+        return 0
+
+    def snapshot(self):
+        return {'calls': self.calls, 'timed': self.timed, 'total_ns': self.total_ns,
+                'mean_ns': self.total_ns // self.timed if self.timed else 0,
+                'min_ns': self.min_ns or 0, 'max_ns': self.max_ns,
+                'p50_ns': self.percentile(50), 'p90_ns': self.percentile(90), 'p99_ns': self.percentile(99)}
+
+profile_registry = {}
+
+def profiled(sample_every=1, registry=profile_registry):
+    def decorate(func):
+        name = '%s.%s' % (func.__module__, func.__qualname__)
+        stats = registry.setdefault(name, FunctionStats(name))
+        perf_counter_ns = time.perf_counter_ns
+
+        @functools.wraps(func)
+        def profiled_func(*args, **kwargs):
+            stats.calls += 1
+            if stats.calls % sample_every:
+                return func(*args, **kwargs)
+            t0 = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.record(perf_counter_ns() - t0)
+        profiled_func.stats = stats
+        return profiled_func
+    return decorate
+
+def snapshot(registry=profile_registry):
+    return {name: stats.snapshot() for name, stats in registry.items()}
+
+def report_json(registry=profile_registry):
+    return json.dumps(snapshot(registry), indent=2, sort_keys=True)
+
+def report_text(registry=profile_registry):
+    columns = ('calls', 'timed', 'mean_ns', 'min_ns', 'p50_ns', 'p90_ns', 'p99_ns', 'max_ns')
+    lines = ['%-40s' % 'function' + ''.join('%12s' % column for column in columns)]
+    for name, stats in sorted(snapshot(registry).items()):
+        lines.append('%-40s' % name + ''.join('%12d' % stats[column] for column in columns))
+    return '\n'.join(lines)
+
+@profiled(sample_every=10)
+def profiled_factorial(n):
+    return 1 if n < 2 else n*profiled_factorial(n-1)
+
+if __name__=='__main__':
+    for i in range(1000):
+        profiled_factorial(20)
+    print(report_text())
+    print(report_json())
+
+# Example 9: A memoization decorator with limits, TTL and stats
+# functools.lru_cache (Example 5) only limits the number of entries, keeps them forever and, when many threads
+# miss the same key at the same time, all of them run the function (a "thundering herd")
+# memoize adds:
+# - maxsize (entries) and max_bytes (measured with sizeof, sys.getsizeof by default) limits
+# - ttl: seconds after which an entry expires and is computed again
+# - policy='lru' evicts the least recently used entry, policy='lfu' the least frequently used one (ties go to the LRU)
+# - only the first thread that misses a key computes it; the others wait for its result (or its exception)
+# - coroutine functions are supported, and concurrent awaits of the same key share a single call. If the coroutine
+#   running the call is cancelled, one of the waiters runs it again instead of all of them being cancelled
+# - cache_stats() returns hits, misses, coalesced calls, evictions, expirations, size and the hit rate
+# Note: the LFU eviction scans every entry, which is fine for caches of a few thousand entries
+import asyncio
+import inspect
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+
+CacheStats = namedtuple('CacheStats', 'hits misses coalesced evictions expirations currsize nbytes hit_rate')
+
+class _Entry:
+    __slots__ = ('value', 'size', 'expires', 'uses')
+
+    def __init__(self, value, size, expires):
+        self.value = value
+        self.size = size
+        self.expires = expires
+        self.uses = 1
+
+class _Pending:
+    """The result of a call that other threads are waiting for"""
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = self.error = None
+
+class _LeaderCancelled(Exception):
+    """Given to the coroutines waiting for a call whose leader was cancelled, so they try again"""
+
+class MemoCache:
+    def __init__(self, maxsize=128, max_bytes=None, ttl=None, policy='lru', sizeof=sys.getsizeof, timer=time.monotonic):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError("policy must be 'lru' or 'lfu', not %r" % (policy,))
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.policy = policy
+        self.sizeof = sizeof
+        self.timer = timer
+        self._data = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = self.hits = self.misses = self.coalesced = self.evictions = self.expirations = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            hit_rate = (self.hits + self.coalesced) / lookups if lookups else 0.0
+            return CacheStats(self.hits, self.misses, self.coalesced, self.evictions, self.expirations,
+                              len(self._data), self.nbytes, hit_rate)
+
+    def _lookup(self, key):
+        """Must be called with the lock held. Returns the entry or None"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry.expires is not None and entry.expires <= self.timer():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        entry.uses += 1
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def _remove(self, key):
+        self.nbytes -= self._data.pop(key).size
+
+    def _store(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # it would never fit
+        expires = None if self.ttl is None else self.timer() + self.ttl
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = _Entry(value, size, expires)
+            self.nbytes += size
+            while (self.maxsize is not None and len(self._data) > self.maxsize) or \
+                    (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                if self.policy == 'lru':
+                    victim = next(iter(self._data))
+                else:
+                    # The new entry is left out, otherwise with uses=1 it would always be the victim and, once the
+                    # other entries were used twice, no new key would ever get in
+                    candidates = [k for k in self._data if k != key] or [key]
+                    victim = min(candidates, key=lambda k: self._data[k].uses)
+                self._remove(victim)
+                self.evictions += 1
+
+    def get_or_call(self, key, func, args, kwargs):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry.value
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = _Pending()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+        try:
+            pending.value = func(*args, **kwargs)
+            self._store(key, pending.value)
+            return pending.value
+        except BaseException as exc:
+            pending.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.event.set()
+
+    async def get_or_await(self, key, func, args, kwargs):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry.value
+            future = self._pending.get(key)
+            leader = future is None
+            if leader:
+                future = self._pending[key] = asyncio.get_running_loop().create_future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            try:
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                # The first waiter to get here becomes the new leader, the others wait for it
+                return await self.get_or_await(key, func, args, kwargs)
+        try:
+            value = await func(*args, **kwargs)
+            self._store(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            # Only the leader was cancelled, the waiters must not fail with it
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            future.exception()  # mark it as retrieved, in case nobody else was waiting
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+def memoize(maxsize=128, max_bytes=None, ttl=None, policy='lru', sizeof=sys.getsizeof):
+    def decorate(func):
+        cache = MemoCache(maxsize, max_bytes, ttl, policy, sizeof)
+
+        def make_key(args, kwargs):
+            return (args, tuple(sorted(kwargs.items()))) if kwargs else args
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def memoized(*args, **kwargs):
+                return await cache.get_or_await(make_key(args, kwargs), func, args, kwargs)
+        else:
+            @functools.wraps(func)
+            def memoized(*args, **kwargs):
+                return cache.get_or_call(make_key(args, kwargs), func, args, kwargs)
+        memoized.cache_stats = cache.stats
+        memoized.cache_clear = cache.clear
+        return memoized
+    return decorate
+
+@memoize(maxsize=256, ttl=3600)
+def memo_fibonacci(n):
+    if n < 2:
+        return n
+    return memo_fibonacci(n-2) + memo_fibonacci(n-1)
+
+@memoize(ttl=60)
+async def slow_lookup(key):
+    await asyncio.sleep(.1)
+    return key.upper()
+
+async def lookup_many():
+    return await asyncio.gather(*(slow_lookup('voß') for _ in range(10)))
+
+if __name__=='__main__':
+    print(memo_fibonacci(100), memo_fibonacci.cache_stats())
+    print(asyncio.run(lookup_many())[0], slow_lookup.cache_stats())
+
+# Example 10: Finding the best promotion for millions of orders
+# best_promo (Example 3) works on one order at a time. best_promo_many cuts a list of orders in chunks and evaluates
+# every registered promotion on each chunk in a pool of processes, returning (promotion name, discount) per order
+# Pickling the orders to the workers costs about as much as evaluating them, so where processes are forked the
+# workers inherit the orders and each task is only a (start, stop) range. The results come back as two arrays per
+# chunk (promotion index and discount) instead of a list of tuples. Without fork, chunks of orders are pickled
+# The promotions only need an order with customer, cart and total(), so these are the same classes as chapter 6
+import multiprocessing
+import os
+import random
+from concurrent import futures
+
+Customer = namedtuple('Customer', 'name fidelity')
+
+class LineItem:
+    __slots__ = ('product', 'quantity', 'price')
+
+    def __init__(self, product, quantity, price):
+        self.product = product
+        self.quantity = quantity
+        self.price = price
+
+    def total(self):
+        return self.price * self.quantity
+
+class Order:
+    __slots__ = ('customer', 'cart')
+
+    def __init__(self, customer, cart):
+        self.customer = customer
+        self.cart = list(cart)
+
+    def total(self):
+        return sum(item.total() for item in self.cart)
+
+def best_promo_with_name(order):
+    """Like best_promo, but also tells which promotion won (the first one registered, on ties)"""
+    discount, name = 0, None
+    for promo in promos:
+        value = promo(order)
+        if name is None or value > discount:
+            discount, name = value, promo.__name__
+    return name, discount
+
+def _best_promo_indexes(orders):
+    """Index in promos of the best promotion (-1 if there are none) and discount of each order, as two arrays"""
+    indexes, discounts = array('i'), array('d')
+    for order in orders:
+        best, discount = -1, 0
+        for i, promo in enumerate(promos):
+            value = promo(order)
+            if best < 0 or value > discount:
+                best, discount = i, value
+        indexes.append(best)
+        discounts.append(discount)
+    return indexes, discounts
+
+_shared_orders = None  # the orders of the running best_promo_many, inherited by the forked workers
+
+def _best_promo_range(bounds):
+    start, stop = bounds
+    return _best_promo_indexes(_shared_orders[i] for i in range(start, stop))
+
+def best_promo_many(orders, chunk_size=10_000, workers=None):
+    """Return [(promotion name, discount) for each order], computed in a pool of processes"""
+    global _shared_orders
+    orders = orders if isinstance(orders, list) else list(orders)
+    bounds = [(start, min(start + chunk_size, len(orders))) for start in range(0, len(orders), chunk_size)]
+    if 'fork' in multiprocessing.get_all_start_methods():
+        # The forked workers already have the orders, so each task is just a range of indexes
+        context, function, tasks = multiprocessing.get_context('fork'), _best_promo_range, bounds
+    else:
+        context, function, tasks = None, _best_promo_indexes, [orders[start:stop] for start, stop in bounds]
+    names = [promo.__name__ for promo in promos] + [None]  # index -1 is None
+    results = []
+    _shared_orders = orders
+    try:
+        with futures.ProcessPoolExecutor(workers, mp_context=context) as executor:
+            for indexes, discounts in executor.map(function, tasks):
+                results.extend(zip(map(names.__getitem__, indexes), discounts))
+    finally:
+        _shared_orders = None
+    return results
+
+def random_orders(count, seed=1729):
+    random.seed(seed)
+    customers = [Customer('customer%d' % i, random.choice((0, 500, 1000, 1500))) for i in range(100)]
+    # The line items are shared between orders, to keep the memory of the benchmark small
+    items = [LineItem('product%d' % i, random.choice((1, 2, 5, 10, 20, 30)), random.randint(1, 100) / 10)
+             for i in range(1000)]
+    return [Order(random.choice(customers), random.sample(items, random.randint(1, 12))) for _ in range(count)]
+
+def bench_best_promo(count=1_000_000):
+    """Compare the serial loop with best_promo_many on 1, 2, 4... processes up to the number of cores"""
+    orders = random_orders(count)
+    t0 = time.perf_counter()
+    serial = [best_promo_with_name(order) for order in orders]
+    serial_time = time.perf_counter() - t0
+    print('%d orders: serial %.2fs' % (count, serial_time))
+    workers = 1
+    while True:
+        t0 = time.perf_counter()
+        parallel = best_promo_many(orders, workers=workers)
+        parallel_time = time.perf_counter() - t0
+        assert serial == parallel
+        print('%3d processes %.2fs (%.2fx)' % (workers, parallel_time, serial_time / parallel_time))
+        if workers >= os.cpu_count():
+            break
+        workers = min(2 * workers, os.cpu_count())
+
+if __name__=='__main__':
+    orders = random_orders(5)
+    print([best_promo(order) for order in orders])
+    print(best_promo_many(orders, chunk_size=2))
+    bench_best_promo()
+
+# Example 11: Compiling the promotions into a single pass over the cart
+# Each promotion function walks order.cart on its own (and order.total() walks it again), so best_promo scans the
+# cart once per promotion. If promotions are declared as data (rules), they can be compiled into one function:
+# compile_rules writes the source of a function that computes the total, the bulk item discounts and the distinct
+# products in a single loop over the cart, and then returns the discount of every rule
+# Like namedtuple in the standard library, the source is built as text and turned into a function with exec,
+# so the loop has no inner loop over the rules. Thresholds and rates are checked to be numbers before that
+# kind: 'fidelity' (customer.fidelity >= threshold), 'bulk_item' (each line with quantity >= threshold)
+# or 'distinct' (number of distinct products >= threshold); rate is the discount over the total or the line
+import numbers
+
+PromoRule = namedtuple('PromoRule', 'name kind threshold rate')
+
+PROMO_RULES = [
+    PromoRule('fidelity', 'fidelity', 1000, .05),
+    PromoRule('bulk_item', 'bulk_item', 20, .1),
+    PromoRule('large_order', 'distinct', 10, .07),
+]
+
+class CompiledPromotions:
+    def __init__(self, rules):
+        self.names = tuple(rule.name for rule in rules)
+        self.source = self._generate(rules)
+        namespace = {}
+        exec(self.source, namespace)
+        self.discounts = namespace['discounts']
+
+    @staticmethod
+    def _generate(rules):
+        loop, results = [], []
+        for i, rule in enumerate(rules):
+            if not isinstance(rule.threshold, numbers.Real) or not isinstance(rule.rate, numbers.Real):
+                raise TypeError('threshold and rate of %r must be numbers' % (rule.name,))
+            if rule.kind == 'fidelity':
+                results.append('(total * %r if order.customer.fidelity >= %r else 0)' % (rule.rate, rule.threshold))
+            elif rule.kind == 'bulk_item':
+                loop.append('        if item.quantity >= %r:\n            bulk%d += item_total * %r'
+                            % (rule.threshold, i, rule.rate))
+                results.append('bulk%d' % i)
+            elif rule.kind == 'distinct':
+                results.append('(total * %r if len(products) >= %r else 0)' % (rule.rate, rule.threshold))
+            else:
+                raise ValueError('unknown kind of promotion rule: %r' % (rule.kind,))
+        distinct = any(rule.kind == 'distinct' for rule in rules)
+        lines = ['def discounts(order):', '    total = 0']
+        if distinct:
+            lines.append('    products = set()')
+        lines += ['    bulk%d = 0' % i for i, rule in enumerate(rules) if rule.kind == 'bulk_item']
+        lines += ['    for item in order.cart:', '        item_total = item.total()', '        total += item_total']
+        if distinct:
+            lines.append('        products.add(item.product)')
+        lines += loop
+        lines.append('    return [%s]' % ', '.join(results))
+        return '\n'.join(lines)
+
+    def best(self, order):
+        """Return (name, discount) of the best rule, the first one on ties, like best_promo_with_name"""
+        discounts = self.discounts(order)
+        best = max(range(len(discounts)), key=discounts.__getitem__)
+        return self.names[best], discounts[best]
+
+def rule_function(rule):
+    """Build the promotion function of a rule, written like fidelity, bulk_item and large_order"""
+    if rule.kind == 'fidelity':
+        def promo(order):
+            return order.total() * rule.rate if order.customer.fidelity >= rule.threshold else 0
+    elif rule.kind == 'bulk_item':
+        def promo(order):
+            discount = 0
+            for item in order.cart:
+                if item.quantity >= rule.threshold:
+                    discount += item.total() * rule.rate
+            return discount
+    else:
+        def promo(order):
+            distinct_items = {item.product for item in order.cart}
+            return order.total() * rule.rate if len(distinct_items) >= rule.threshold else 0
+    promo.__name__ = rule.name
+    return promo
+
+def bench_rules(rule_counts=(3, 10, 30, 100), order_count=10_000):
+    """Compare max(promo(order) for promo in functions) with the compiled rules as the number of promotions grows"""
+    orders = random_orders(order_count)
+    kinds = [('fidelity', 500, 1000, 1500), ('bulk_item', 5, 10, 20, 30), ('distinct', 3, 5, 10)]
+    for count in rule_counts:
+        rules = []
+        for i in range(count):
+            kind, *thresholds = kinds[i % len(kinds)]
+            rules.append(PromoRule('promo%d' % i, kind, thresholds[i // len(kinds) % len(thresholds)], (i % 10 + 1) / 100))
+        functions = [rule_function(rule) for rule in rules]
+        compiled = CompiledPromotions(rules)
+        t0 = time.perf_counter()
+        expected = [max(promo(order) for promo in functions) for order in orders]
+        functions_time = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        fused = [max(compiled.discounts(order)) for order in orders]
+        compiled_time = time.perf_counter() - t0
+        assert expected == fused
+        print('%4d promotions: functions %.3fs, compiled %.3fs (%.1fx)'
+              % (count, functions_time, compiled_time, functions_time / compiled_time))
+
+compiled_promos = CompiledPromotions(PROMO_RULES)
+if __name__=='__main__':
+    print(compiled_promos.source)
+    orders = random_orders(1000)
+    print(all(compiled_promos.best(order) == best_promo_with_name(order) for order in orders))
+    bench_rules()
+
+# Example 12: One registry for all the promotions, loaded lazily
+# Chapter 6 finds the promotions by scanning globals() for names ending in _promo or with inspect.getmembers on a
+# promotions module, and Example 3 appends them to a list. The scans run again every time they are needed, the
+# modules have to be imported up front, and there is no way of turning a promotion off
+# PromotionRegistry keeps the promotions by name: register works as @registry.register or
+# @registry.register(active=False), enable/disable flip a flag, and every change bumps registry.version, so active()
+# only rebuilds its tuple when the version moved since the last call
+# Promotion modules are imported the first time a promotion is asked for: add_modules only records their names, and
+# after importing one the registry calls its setup(registry) function, which registers the promotions of the module
+# discover(package) lists the modules of a package with pkgutil without importing them; with cache_path the list is
+# saved with the mtime of the package directories as a stamp, so a worker starting again reads the file instead
+import importlib.util
+import pkgutil
+import tempfile
+
+class PromotionRegistry:
+    def __init__(self):
+        self._promotions = {} # name -> [function, active]
+        self._pending = [] # promotion modules not imported yet
+        self._modules = set() # every module added, so a module is only imported and set up once
+        self.version = 0
+        self._active = (-1, ())
+
+    def register(self, func=None, *, active=True, name=None):
+        """Register func as a promotion; a promotion registered again under the same name replaces the old one"""
+        def decorate(func):
+            self._promotions[name or func.__name__] = [func, active]
+            self.version += 1
+            return func
+        return decorate if func is None else decorate(func)
+
+    def add_modules(self, *module_names):
+        for name in module_names:
+            if name not in self._modules:
+                self._modules.add(name)
+                self._pending.append(name)
+
+    def discover(self, package, cache_path=None):
+        """Add the modules of a package, reading their names from cache_path while the package is not changed"""
+        spec = importlib.util.find_spec(package)
+        if spec is None or spec.submodule_search_locations is None:
+            raise ValueError('%r is not a package' % (package,))
+        paths = list(spec.submodule_search_locations)
+        stamp = [os.stat(path).st_mtime_ns for path in paths]
+        modules = None
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path) as fp:
+                cache = json.load(fp)
+            if cache['package'] == package and cache['stamp'] == stamp:
+                modules = cache['modules']
+        if modules is None:
+            modules = sorted(info.name for info in pkgutil.iter_modules(paths, package + '.')
+                             if not info.name.rpartition('.')[2].startswith('_'))
+            if cache_path is not None:
+                with open(cache_path, 'w') as fp:
+                    json.dump({'package': package, 'stamp': stamp, 'modules': modules}, fp)
+        self.add_modules(*modules)
+        return modules
+
+    def _load(self):
+        while self._pending:
+            module = importlib.import_module(self._pending[0])
+            del self._pending[0]
+            setup = getattr(module, 'setup', None)
+            if setup is not None:
+                setup(self)
+
+    def _set_active(self, name, active):
+        self._load()
+        entry = self._promotions[name]
+        if entry[1] != active:
+            entry[1] = active
+            self.version += 1
+
+    def enable(self, name):
+        self._set_active(name, True)
+
+    def disable(self, name):
+        self._set_active(name, False)
+
+    def active(self):
+        """Tuple of the active promotions, in the order they were registered"""
+        self._load()
+        version, promotions = self._active
+        if version != self.version:
+            promotions = tuple(func for func, active in self._promotions.values() if active)
+            self._active = self.version, promotions
+        return promotions
+
+    def names(self, active=True):
+        self._load()
+        return [name for name, (func, is_active) in self._promotions.items() if is_active or not active]
+
+    def __getitem__(self, name):
+        self._load()
+        return self._promotions[name][0]
+
+    def best(self, order):
+        """Same as best_promo, with the active promotions"""
+        return max((promo(order) for promo in self.active()), default=0)
+
+promo_registry = PromotionRegistry()
+promo_registry.register(fidelity)
+promo_registry.register(bulk_item)
+promo_registry.register(large_order, active=False)
+
+def bench_registry(calls=100_000):
+    """Compare the globals() scan of chapter 6 with the cached tuple of the registry"""
+    namespace = dict(globals())
+    t0 = time.perf_counter()
+    for _ in range(calls):
+        scanned = [namespace[name] for name in namespace if name.endswith('_promo') and name != 'best_promo']
+    scan_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(calls):
+        cached = promo_registry.active()
+    cached_time = time.perf_counter() - t0
+    print('%d lookups: globals() scan %.3fs, registry %.3fs' % (calls, scan_time, cached_time))
+
+if __name__=='__main__':
+    print(promo_registry.names(), promo_registry.version)
+    promo_registry.enable('large_order')
+    print(promo_registry.names(), promo_registry.version)
+    orders = random_orders(1000)
+    print(all(promo_registry.best(order) == best_promo(order) for order in orders))
+    # A package of promotion modules, written to a temporary directory
+    with tempfile.TemporaryDirectory() as tmp:
+        os.mkdir(os.path.join(tmp, 'extra_promos'))
+        open(os.path.join(tmp, 'extra_promos', '__init__.py'), 'w').close()
+        with open(os.path.join(tmp, 'extra_promos', 'holiday.py'), 'w') as fp:
+            fp.write('def setup(registry):\n'
+                     '    @registry.register(active=False)\n'
+                     '    def holiday(order):\n'
+                     '        return order.total() * .2\n')
+        sys.path.insert(0, tmp)
+        cache_path = os.path.join(tmp, 'promos.json')
+        print(promo_registry.discover('extra_promos', cache_path), 'extra_promos.holiday' in sys.modules)
+        print(promo_registry.names(active=False), 'extra_promos.holiday' in sys.modules)
+        promo_registry.enable('holiday')
+        print(promo_registry.names(), promo_registry['holiday'](orders[0]) == orders[0].total() * .2)
+        print(promo_registry.discover('extra_promos', cache_path), promo_registry.names()) # read from promos.json
+        sys.path.remove(tmp)
+    bench_registry()
@@ -73,4 +73,66 @@ print(wref()) # Invoking wref() returns the referenced object
 a_set = {2, 3, 4}
 print(wref())
 print(wref() is None)
-print(wref() is None)
\ No newline at end of file
+print(wref() is None)
+
+# Example 5: A two-tier cache with weak references
+# Holding every cached object with strong references keeps all of them alive forever, and holding none means
+# recomputing them all the time. TwoTierCache keeps the N most recently used objects with strong references (an LRU),
+# and every object also in a WeakValueDictionary: after an object leaves the LRU, it can still be found for as long
+# as something else in the program keeps it alive
+# weakref.finalize registers a callback that runs when the object is collected, which keeps the stats accurate
+# The callback only gets a weak reference to the cache: the finalize registry keeps its callbacks alive, so a bound
+# method would keep the cache (and its factory) alive until every object it created was collected
+# Note: the objects must support weak references, like the sets of Example 4 (list and dict don't, but their
+# subclasses and most user-defined classes do)
+import collections
+
+class TwoTierCache:
+    def __init__(self, factory, strong_size=128):
+        self.factory = factory
+        self.strong_size = strong_size
+        self._strong = collections.OrderedDict()
+        self._weak = weakref.WeakValueDictionary()
+        self._ref = weakref.ref(self)
+        self.strong_hits = self.weak_hits = self.misses = self.collected = 0
+
+    def __getitem__(self, key):
+        if key in self._strong:
+            self.strong_hits += 1
+            self._strong.move_to_end(key)
+            return self._strong[key]
+        value = self._weak.get(key)
+        if value is not None:
+            # It was still alive elsewhere, so it goes back to the strong tier
+            self.weak_hits += 1
+        else:
+            self.misses += 1
+            value = self.factory(key)
+            self._weak[key] = value
+            weakref.finalize(value, TwoTierCache._on_collect, self._ref)
+        self._strong[key] = value
+        if len(self._strong) > self.strong_size:
+            self._strong.popitem(last=False)
+        return value
+
+    @staticmethod
+    def _on_collect(cache_ref):
+        cache = cache_ref()
+        if cache is not None:
+            cache.collected += 1
+
+    def __contains__(self, key):
+        return key in self._strong or key in self._weak
+
+    def stats(self):
+        return {'strong': len(self._strong), 'alive': len(self._weak), 'strong_hits': self.strong_hits,
+                'weak_hits': self.weak_hits, 'misses': self.misses, 'collected': self.collected}
+
+cache = TwoTierCache(lambda n: {i * i for i in range(n)}, strong_size=2)
+kept = cache[10]  # this one is also referenced by the variable kept
+cache[20]
+cache[30]  # 10 leaves the strong tier, but it is still alive
+print(cache.stats())
+print(cache[10] is kept)  # found in the weak tier, without calling the factory again
+cache[40]  # 20 and 30 are out of the strong tier now and, as nobody else uses them, they were collected
+print(20 in cache, cache.stats())
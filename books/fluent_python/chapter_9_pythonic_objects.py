@@ -73,6 +73,333 @@ joaoAluno.estudar()
 # Example 3: adding slots attributes to a class
 # By defining __slots__ in the class, you are telling the interpreter: “These are all the
 # instance attributes in this class.”
+# The x and y slots are stored as _Vector2d__x and _Vector2d__y, and typecode is the array typecode used by
+# __bytes__ and frombytes: the first byte is the typecode, followed by the two components as C doubles
+from array import array
+import math
+import numbers
+
+def _components(other):
+    """Return (x, y) if other is an iterable of two real numbers, otherwise None"""
+    try:
+        components = tuple(other)
+    except TypeError:
+        return None
+    if len(components) != 2 or not all(isinstance(c, numbers.Real) for c in components):
+        return None
+    return components
+
 class Vector2d:
     __slots__ = ('__x', '__y')
     typecode = 'd'
+
+    def __init__(self, x, y):
+        self.__x = float(x)
+        self.__y = float(y)
+
+    @property
+    def x(self):
+        return self.__x
+
+    @property
+    def y(self):
+        return self.__y
+
+    def __iter__(self):
+        return iter((self.__x, self.__y))
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(type(self).__name__, *self)
+
+    def __str__(self):
+        return str(tuple(self))
+
+    def __bytes__(self):
+        return bytes([ord(self.typecode)]) + bytes(array(self.typecode, self))
+
+    @classmethod
+    def frombytes(cls, octets):
+        typecode = chr(octets[0])
+        memv = memoryview(octets[1:]).cast(typecode)
+        return cls(*memv)
+
+    def __eq__(self, other):
+        try:
+            return tuple(self) == tuple(other)
+        except TypeError:
+            return NotImplemented
+
+    def __hash__(self):
+        return hash((self.__x, self.__y))
+
+    def __abs__(self):
+        return math.hypot(self.__x, self.__y)
+
+    def __bool__(self):
+        return bool(abs(self))
+
+    def angle(self):
+        return math.atan2(self.__y, self.__x)
+
+    def __format__(self, fmt_spec=''):
+        if fmt_spec.endswith('p'):
+            fmt_spec = fmt_spec[:-1]
+            coords = (abs(self), self.angle())
+            outer_fmt = '<{}, {}>'
+        else:
+            coords = self
+            outer_fmt = '({}, {})'
+        return outer_fmt.format(*(format(c, fmt_spec) for c in coords))
+
+    # Arithmetic returns NotImplemented for unsupported operands, so Python can try the reflected method of the other one
+    def __add__(self, other):
+        components = _components(other)
+        if components is None:
+            return NotImplemented
+        ox, oy = components
+        return type(self)(self.__x + ox, self.__y + oy)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        components = _components(other)
+        if components is None:
+            return NotImplemented
+        ox, oy = components
+        return type(self)(self.__x - ox, self.__y - oy)
+
+    def __rsub__(self, other):
+        components = _components(other)
+        if components is None:
+            return NotImplemented
+        ox, oy = components
+        return type(self)(ox - self.__x, oy - self.__y)
+
+    def __mul__(self, scalar):
+        if not isinstance(scalar, numbers.Real):
+            return NotImplemented
+        return type(self)(self.__x * scalar, self.__y * scalar)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, scalar):
+        if not isinstance(scalar, numbers.Real):
+            return NotImplemented
+        return type(self)(self.__x / scalar, self.__y / scalar)
+
+    def __neg__(self):
+        return type(self)(-self.__x, -self.__y)
+
+    def __pos__(self):
+        return type(self)(self.__x, self.__y)
+
+v1 = Vector2d(3, 4)
+print(repr(v1), abs(v1), format(v1, '.3fp'), v1 + (1, 1), 2 * v1, -v1)
+print(Vector2d.frombytes(bytes(v1)) == v1, len(bytes(v1)))
+
+# Example 4: Millions of points in one array
+# A list of Vector2d keeps one object per point (an instance with __slots__, two float objects and the list
+# pointer). Vector2dArray keeps every point in one array('d') as x0, y0, x1, y1, ..., 16 bytes per point
+# add, scale, norms and angles work on the whole array at once: with NumPy they run over a view of the same buffer
+# (numpy.frombuffer does not copy), otherwise with map over the array, which avoids building Vector2d objects
+# view() is a memoryview of the buffer, so the points can be written to a file or a socket without a copy
+import itertools
+import operator
+import random
+import sys
+import time
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class Vector2dArray:
+    typecode = Vector2d.typecode
+
+    def __init__(self, points=()):
+        self._coords = array(self.typecode)
+        for point in points:
+            x, y = point
+            self._coords.append(x)
+            self._coords.append(y)
+
+    @classmethod
+    def _from_coords(cls, coords):
+        result = cls.__new__(cls)
+        result._coords = coords
+        return result
+
+    @classmethod
+    def fromxy(cls, xs, ys):
+        """Build from two sequences of coordinates"""
+        if len(xs) != len(ys):
+            raise ValueError('xs and ys must have the same length')
+        coords = array(cls.typecode, bytes(2 * len(xs) * array(cls.typecode).itemsize))
+        coords[0::2] = array(cls.typecode, xs)
+        coords[1::2] = array(cls.typecode, ys)
+        return cls._from_coords(coords)
+
+    def __len__(self):
+        return len(self._coords) // 2
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return self._from_coords(self._coords[2 * start:2 * stop])
+            return type(self)(self[i] for i in range(start, stop, step))
+        index = operator.index(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Vector2dArray index out of range')
+        return Vector2d(self._coords[2 * index], self._coords[2 * index + 1])
+
+    def __iter__(self):
+        coords = iter(self._coords)
+        return itertools.starmap(Vector2d, zip(coords, coords))
+
+    def __repr__(self):
+        points = ', '.join('({!r}, {!r})'.format(*point) for point in itertools.islice(self, 5))
+        return '{}([{}{}])'.format(type(self).__name__, points, ', ...' if len(self) > 5 else '')
+
+    def __eq__(self, other):
+        if isinstance(other, Vector2dArray):
+            return self._coords == other._coords
+        return NotImplemented
+
+    def append(self, point):
+        x, y = point
+        self._coords.append(x)
+        self._coords.append(y)
+
+    @property
+    def xs(self):
+        return self._coords[0::2]
+
+    @property
+    def ys(self):
+        return self._coords[1::2]
+
+    def _numpy(self):
+        return numpy.frombuffer(self._coords, dtype=numpy.float64)
+
+    def _zeros(self, size):
+        # An array('d') of zeros and a NumPy view of it, so the NumPy operations can write the result in place
+        coords = array(self.typecode, bytes(size * self._coords.itemsize))
+        return coords, numpy.frombuffer(coords, dtype=numpy.float64)
+
+    def add(self, other):
+        """Add another Vector2dArray of the same length, or the same vector (any x, y pair) to every point"""
+        if isinstance(other, Vector2dArray):
+            if len(other) != len(self):
+                raise ValueError('arrays of different lengths: %d and %d' % (len(self), len(other)))
+            if numpy is not None:
+                coords, out = self._zeros(len(self._coords))
+                numpy.add(self._numpy(), other._numpy(), out=out)
+                return self._from_coords(coords)
+            return self._from_coords(array(self.typecode, map(operator.add, self._coords, other._coords)))
+        components = _components(other)
+        if components is None:
+            raise TypeError('can only add a Vector2dArray or an (x, y) pair, not %r' % (other,))
+        x, y = components
+        if numpy is not None:
+            coords, out = self._zeros(len(self._coords))
+            numpy.add(self._numpy().reshape(-1, 2), (x, y), out=out.reshape(-1, 2))
+            return self._from_coords(coords)
+        return self._from_coords(array(self.typecode, map(operator.add, self._coords, itertools.cycle((x, y)))))
+
+    def scale(self, factor):
+        if not isinstance(factor, numbers.Real):
+            raise TypeError('the scale factor must be a real number, not %r' % (factor,))
+        factor = float(factor)
+        if numpy is not None:
+            coords, out = self._zeros(len(self._coords))
+            numpy.multiply(self._numpy(), factor, out=out)
+            return self._from_coords(coords)
+        return self._from_coords(array(self.typecode, map(factor.__mul__, self._coords)))
+
+    def __add__(self, other):
+        try:
+            return self.add(other)
+        except TypeError:
+            return NotImplemented
+
+    __radd__ = __add__
+
+    def __mul__(self, scalar):
+        try:
+            return self.scale(scalar)
+        except TypeError:
+            return NotImplemented
+
+    __rmul__ = __mul__
+
+    def norms(self):
+        """array('d') with abs() of every point"""
+        if numpy is not None:
+            norms, out = self._zeros(len(self))
+            points = self._numpy()
+            numpy.hypot(points[0::2], points[1::2], out=out)
+            return norms
+        return array(self.typecode, map(math.hypot, self.xs, self.ys))
+
+    def angles(self):
+        """array('d') with the angle() of every point"""
+        if numpy is not None:
+            angles, out = self._zeros(len(self))
+            points = self._numpy()
+            numpy.arctan2(points[1::2], points[0::2], out=out)
+            return angles
+        return array(self.typecode, map(math.atan2, self.ys, self.xs))
+
+    def view(self):
+        """memoryview of the buffer (x0, y0, x1, y1, ...), shared with the array, not copied"""
+        return memoryview(self._coords)
+
+    def __bytes__(self):
+        return bytes([ord(self.typecode)]) + bytes(self._coords)
+
+    @classmethod
+    def frombytes(cls, octets):
+        coords = array(chr(octets[0]))
+        coords.frombytes(memoryview(octets)[1:])
+        return cls._from_coords(coords)
+
+    def nbytes(self):
+        return sys.getsizeof(self._coords)
+
+def list_nbytes(points):
+    """Memory of a list of Vector2d: the list, every instance and its two floats"""
+    return sys.getsizeof(points) + sum(sys.getsizeof(p) + sys.getsizeof(p.x) + sys.getsizeof(p.y) for p in points)
+
+def bench_vectors(count=1_000_000):
+    """Compare a list of Vector2d with a Vector2dArray for memory, add, scale, norm and angle"""
+    random.seed(1729)
+    xs = [random.uniform(-100, 100) for _ in range(count)]
+    ys = [random.uniform(-100, 100) for _ in range(count)]
+    points = list(map(Vector2d, xs, ys))
+    vectors = Vector2dArray.fromxy(xs, ys)
+    print('%d points: list of Vector2d %.1f MB, Vector2dArray %.1f MB'
+          % (count, list_nbytes(points) / 2**20, vectors.nbytes() / 2**20))
+    offset = Vector2d(1, 2)
+    operations = [
+        ('add', lambda: [p + offset for p in points], lambda: vectors + offset),
+        ('scale', lambda: [p * 3 for p in points], lambda: vectors * 3),
+        ('norm', lambda: [abs(p) for p in points], vectors.norms),
+        ('angle', lambda: [p.angle() for p in points], vectors.angles),
+    ]
+    for name, on_list, on_array in operations:
+        t0 = time.perf_counter()
+        on_list()
+        list_time = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        on_array()
+        array_time = time.perf_counter() - t0
+        print('%6s: list %.3fs, Vector2dArray %.3fs (%.1fx)' % (name, list_time, array_time, list_time / array_time))
+
+vectors = Vector2dArray([(3, 4), (1, 0), (0, 2)])
+print(vectors, vectors + Vector2d(1, 1), vectors * 2, list(vectors.norms()), list(vectors.angles()))
+print(Vector2dArray.frombytes(bytes(vectors)) == vectors, vectors.view().nbytes)
+if __name__ == '__main__':
+    bench_vectors()